@@ -13,7 +13,8 @@
 # limitations under the License.
 
 from django.contrib import admin
-from distribution.models import Vpnuser, Issue, OutlineUser
+from distribution.models import (
+    Vpnuser, Issue, OutlineUser, PooledKey, KeyRevocation)
 
 
 @admin.register(OutlineUser)
@@ -57,4 +58,30 @@ class UserAdmin(admin.ModelAdmin):
     search_fields = ['username']
 
 
+@admin.register(PooledKey)
+class PooledKeyAdmin(admin.ModelAdmin):
+    list_display = (
+        'id',
+        'server',
+        'outline_key_id',
+        'created_date')
+    list_filter = ['server']
+    list_per_page = 10
+    list_max_show_all = 100
+
+
+@admin.register(KeyRevocation)
+class KeyRevocationAdmin(admin.ModelAdmin):
+    list_display = (
+        'id',
+        'server',
+        'outline_key_id',
+        'status',
+        'attempts',
+        'run_after')
+    list_filter = ['status', 'server']
+    list_per_page = 10
+    list_max_show_all = 100
+
+
 admin.site.register(Issue)
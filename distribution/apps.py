@@ -18,3 +18,6 @@ from django.apps import AppConfig
 class DistributionConfig(AppConfig):
     name = 'distribution'
     verbose_name = 'VPN Distributing App'
+
+    def ready(self):
+        import distribution.signals  # noqa: F401
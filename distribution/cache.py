@@ -0,0 +1,101 @@
+# Copyright 2020 ASL19 Organization
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import hashlib
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+
+from distribution.metrics import Counter, REGISTRY
+
+CACHE_KINDS = ('user', 'outline')
+
+CACHE_REQUESTS = Counter(
+    'distribution_cache_requests_total',
+    'Read-through cache lookups by cache and result',
+    ('cache', 'result'))
+REGISTRY.append(CACHE_REQUESTS)
+
+
+def get_cache():
+    return caches[getattr(settings, 'DISTRIBUTION_CACHE_ALIAS', 'default')]
+
+
+def cache_key(kind, username):
+    digest = hashlib.md5(username.encode('utf-8')).hexdigest()
+    return 'distribution:{}:{}'.format(kind, digest)
+
+
+def get_cached(kind, username):
+    """
+    Return the cached validators and response data of the user, or None.
+    Entries are only cached along with their validators, so a hit needs
+    no database query.
+    """
+    entry = get_cache().get(cache_key(kind, username))
+    CACHE_REQUESTS.inc((kind, 'hit' if entry is not None else 'miss'))
+    return entry
+
+
+def set_cached(kind, username, validators, data):
+    """
+    Cache the response data of the user along with its validators
+    and return the entry. Data without validators is not cached.
+    """
+    entry = (validators, dict(data))
+    if validators is not None:
+        get_cache().set(
+            cache_key(kind, username),
+            entry,
+            getattr(settings, 'DISTRIBUTION_CACHE_TIMEOUT', 60))
+    return entry
+
+
+def invalidate_users(usernames):
+    """
+    Drop the cached data of the users once the current
+    transaction is committed
+    """
+    keys = [
+        cache_key(kind, username)
+        for username in usernames if username
+        for kind in CACHE_KINDS]
+    if keys:
+        transaction.on_commit(lambda: get_cache().delete_many(keys))
+
+
+def idempotency_cache_key(username, idempotency_key):
+    digest = hashlib.md5(
+        '{}\0{}'.format(username, idempotency_key).encode('utf-8')).hexdigest()
+    return 'distribution:idempotency:{}'.format(digest)
+
+
+def get_idempotent_result(username, idempotency_key):
+    """
+    Return the stored result of an earlier request of the user
+    with the same idempotency key, or None
+    """
+    return get_cache().get(idempotency_cache_key(username, idempotency_key))
+
+
+def set_idempotent_result(username, idempotency_key, data):
+    """
+    Store the result of a request for IDEMPOTENCY_KEY_TIMEOUT seconds
+    so that retries with the same key replay it
+    """
+    get_cache().set(
+        idempotency_cache_key(username, idempotency_key),
+        dict(data),
+        getattr(settings, 'IDEMPOTENCY_KEY_TIMEOUT', 86400))
@@ -0,0 +1,134 @@
+# Copyright 2020 ASL19 Organization
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import hashlib
+from urllib.parse import urlencode
+
+from django.db.models import Count, Max
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date
+from rest_framework.response import Response
+
+from distribution.cache import get_cached, set_cached
+from distribution.models import Vpnuser
+
+
+class Validators(object):
+    """
+    ETag and Last-Modified of a response, computed without serializing it
+    """
+
+    def __init__(self, parts, last_modified):
+        self.etag = '"{}"'.format(hashlib.md5(
+            ':'.join(str(part) for part in parts).encode('utf-8')).hexdigest())
+        self.last_modified = max(
+            (value for value in last_modified if value is not None), default=None)
+
+    @property
+    def timestamp(self):
+        if self.last_modified is None:
+            return None
+        return int(self.last_modified.timestamp())
+
+    def not_modified(self, request):
+        """
+        Return a 304 response if the client's copy is still fresh, or None
+        """
+        return get_conditional_response(
+            request, etag=self.etag, last_modified=self.timestamp)
+
+    def apply(self, response):
+        response['ETag'] = self.etag
+        if self.last_modified is not None:
+            response['Last-Modified'] = http_date(self.timestamp)
+        return response
+
+
+def user_validators(username):
+    """
+    Validators of a user and their current key from a single query,
+    or None if the user does not exist
+    """
+    row = Vpnuser.objects.filter(username=username).values_list(
+        'id', 'updated_date', 'current_key', 'current_key__updated_date').first()
+    if row is None:
+        return None
+    return Validators(row, row[1::2])
+
+
+def load_with_validators(validators, username, loader):
+    """
+    Call loader and return its data with the validators of the user
+    read before loading. The validators are read again afterwards,
+    and None is returned in their place if the user changed meanwhile,
+    so data is never paired with the ETag of another version.
+    """
+    data = loader()
+    latest = user_validators(username)
+    if validators is None or latest is None or latest.etag != validators.etag:
+        return None, data
+    return validators, data
+
+
+def queryset_validators(queryset, request):
+    """
+    Validators of a list from the number of its items and their
+    latest change, in a single aggregate query. The query string and
+    the rendered format are part of the ETag, so every page and
+    filter of the list is validated separately.
+    """
+    stats = queryset.order_by().aggregate(
+        count=Count('id'), last_modified=Max('updated_date'))
+    renderer = getattr(request, 'accepted_renderer', None)
+    return Validators(
+        (stats['count'],
+         stats['last_modified'],
+         renderer.format if renderer is not None else '',
+         urlencode(sorted(request.GET.items()))),
+        (stats['last_modified'], ))
+
+
+class ConditionalRetrieveMixin(object):
+    """
+    Serve a user's data from the read-through cache, or answer with 304
+    if the client's copy is up to date. On a cache miss the validators
+    are checked before the data is serialized.
+    """
+    cache_kind = None
+    username_kwarg = 'username'
+
+    def retrieve(self, request, *args, **kwargs):
+        username = self.kwargs.get(self.username_kwarg, None)
+        entry = get_cached(self.cache_kind, username)
+        if entry is None:
+            validators = user_validators(username)
+            if validators is not None:
+                not_modified = validators.not_modified(request)
+                if not_modified is not None:
+                    return not_modified
+            entry = set_cached(
+                self.cache_kind,
+                username,
+                *load_with_validators(
+                    validators,
+                    username,
+                    lambda: self.get_serializer(self.get_object()).data))
+
+        validators, data = entry
+        if validators is None:
+            return Response(data)
+        not_modified = validators.not_modified(request)
+        if not_modified is not None:
+            return not_modified
+        return validators.apply(Response(data))
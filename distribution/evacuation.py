@@ -0,0 +1,92 @@
+# Copyright 2020 ASL19 Organization
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+
+from distribution.issuance import issue_keys
+from distribution.models import Vpnuser
+from server.allocation import invalidate_allocation_index
+from server.models import OutlineServer
+
+
+EVACUATION_LOCK_KEY = 'server:evacuation:{}'
+
+
+def lock_evacuation(server_id):
+    """
+    Mark the evacuation of the server as running, so that it is not
+    started twice. Returns False if it is already running.
+    The lock expires after SERVER_EVACUATION_LOCK_TIMEOUT seconds
+    without progress, in case its worker died.
+    """
+    return cache.add(
+        EVACUATION_LOCK_KEY.format(server_id),
+        True,
+        getattr(settings, 'SERVER_EVACUATION_LOCK_TIMEOUT', 600))
+
+
+def unlock_evacuation(server_id):
+    cache.delete(EVACUATION_LOCK_KEY.format(server_id))
+
+
+def users_on_server(server):
+    """
+    Users whose current key lives on the server
+    """
+    return Vpnuser.objects.filter(
+        banned=False, current_key__server=server)
+
+
+def evacuate_server(server, batch_size=100, workers=8, progress=None):
+    """
+    Stop distributing the server and move every user whose latest key is
+    on it to another eligible server.
+
+    Users are processed in id order, batch by batch. Moved users no
+    longer match, so running it again after a crash picks up where it
+    stopped. progress is called after each batch with the number of
+    moved users, failed users, total users and elapsed seconds.
+    """
+    # The instance may be stale, so only the flag is written
+    OutlineServer.objects.filter(id=server.id).update(is_distributing=False)
+    server.is_distributing = False
+    invalidate_allocation_index()
+
+    total = users_on_server(server).count()
+    moved = failed = 0
+    last_id = 0
+    start = time.monotonic()
+    while True:
+        users = list(
+            users_on_server(server)
+            .filter(id__gt=last_id)
+            .order_by('id')[:batch_size])
+        if not users:
+            break
+        last_id = users[-1].id
+        issued, not_issued = issue_keys(
+            users,
+            workers=workers,
+            exclude_servers={server.id})
+        moved += len(issued)
+        failed += len(not_issued)
+        cache.touch(
+            EVACUATION_LOCK_KEY.format(server.id),
+            getattr(settings, 'SERVER_EVACUATION_LOCK_TIMEOUT', 600))
+        if progress:
+            progress(moved, failed, total, time.monotonic() - start)
+    return moved, failed
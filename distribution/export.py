@@ -0,0 +1,138 @@
+# Copyright 2020 ASL19 Organization
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import csv
+import io
+import json
+import zlib
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.http import StreamingHttpResponse
+
+EXPORT_CONTENT_TYPES = {
+    'csv': 'text/csv; charset=utf-8',
+    'ndjson': 'application/x-ndjson',
+}
+BUFFER_SIZE = 64 * 1024
+
+
+def csv_lines(columns, rows):
+    """
+    Yield the header and rows as CSV lines
+    """
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(columns)
+    for row in rows:
+        writer.writerow(['' if row[column] is None else row[column] for column in columns])
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    yield buffer.getvalue()
+
+
+def ndjson_lines(columns, rows):
+    """
+    Yield the rows as newline delimited JSON
+    """
+    for row in rows:
+        yield json.dumps(
+            {column: row[column] for column in columns},
+            cls=DjangoJSONEncoder) + '\n'
+
+
+def buffered(lines):
+    """
+    Group lines into chunks of about BUFFER_SIZE bytes
+    """
+    chunk = []
+    size = 0
+    for line in lines:
+        data = line.encode('utf-8')
+        chunk.append(data)
+        size += len(data)
+        if size >= BUFFER_SIZE:
+            yield b''.join(chunk)
+            chunk = []
+            size = 0
+    if chunk:
+        yield b''.join(chunk)
+
+
+def gzipped(chunks):
+    """
+    Compress chunks on the fly
+    """
+    compressor = zlib.compressobj(wbits=16 + zlib.MAX_WBITS)
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+def streaming_export(queryset, fields, export_format, compress=False, filename='export'):
+    """
+    Stream the queryset as CSV or NDJSON without loading it in memory.
+    fields is a sequence of (column, lookup) pairs.
+    """
+    columns = [column for column, _ in fields]
+    lookups = [lookup for _, lookup in fields]
+    chunk_size = getattr(settings, 'EXPORT_CHUNK_SIZE', 2000)
+    rows = (
+        dict(zip(columns, values))
+        for values in queryset.values_list(*lookups).iterator(chunk_size=chunk_size))
+
+    if export_format == 'csv':
+        lines = csv_lines(columns, rows)
+    else:
+        lines = ndjson_lines(columns, rows)
+    content = buffered(lines)
+    if compress:
+        content = gzipped(content)
+
+    response = StreamingHttpResponse(
+        content,
+        content_type=EXPORT_CONTENT_TYPES[export_format])
+    response['Content-Disposition'] = 'attachment; filename="{}.{}"'.format(
+        filename, export_format)
+    if compress:
+        response['Content-Encoding'] = 'gzip'
+    return response
+
+
+class StreamingExportMixin(object):
+    """
+    Stream the list as a file when the `export` query parameter is
+    `csv` or `ndjson`. Setting `gzip` to `true` compresses the output.
+    """
+    export_fields = ()
+    export_filename = 'export'
+
+    def get_export_queryset(self):
+        return self.filter_queryset(self.get_queryset())
+
+    def list(self, request, *args, **kwargs):
+        export_format = request.query_params.get('export', None)
+        if export_format not in EXPORT_CONTENT_TYPES:
+            return super(StreamingExportMixin, self).list(request, *args, **kwargs)
+
+        compress = request.query_params.get('gzip', '').lower() == 'true'
+        return streaming_export(
+            self.get_export_queryset(),
+            self.export_fields,
+            export_format,
+            compress=compress,
+            filename=self.export_filename)
@@ -0,0 +1,150 @@
+# Copyright 2020 ASL19 Organization
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import logging
+from collections import Counter, defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+from django.db import transaction
+
+from distribution.cache import invalidate_users
+from distribution.models import Vpnuser, OutlineUser, KeyRevocation
+from distribution.reputation import ReputationSystem
+from server.allocation import (
+    choose_server, get_allocation_index, server_counts, update_user_counts)
+from server.breaker import record_failure, record_success
+from server.clients import get_client
+
+logger = logging.getLogger(__name__)
+
+
+def _new_keys(server, count):
+    """
+    Create count keys on the server, stopping at the first failure
+    """
+    client = get_client(server)
+    keys = []
+    for _ in range(count):
+        try:
+            new_key = client.new()
+        except Exception:
+            new_key = {}
+        if 'id' not in new_key or 'accessUrl' not in new_key:
+            logger.error('Error getting new key from server {}'.format(server.id))
+            record_failure(server.id)
+            break
+        keys.append(new_key)
+    if keys:
+        record_success(server.id)
+    return keys
+
+
+def issue_keys(users, workers=8, exclude_servers=None):
+    """
+    Issue a new key for each of the users in one allocation pass.
+    Keys are created concurrently, one task per server, and saved in
+    a single transaction together with the revocation of previous keys.
+    Returns the list of new OutlineUsers and the list of users
+    that did not get a key.
+    """
+    exclude_servers = set(exclude_servers or ())
+    history = defaultdict(set)
+    for user_id, server_id in OutlineUser.objects.filter(
+            user__in=users).values_list('user_id', 'server_id'):
+        history[user_id].add(server_id)
+
+    # Counts are loaded once and kept up to date with the allocation
+    counts = server_counts([
+        server for servers in get_allocation_index().values() for server in servers])
+    failed = []
+    servers = {}
+    allocation = defaultdict(list)
+    for user in users:
+        level = ReputationSystem.server_level(user.reputation)
+        server = choose_server(
+            level,
+            user.channel,
+            exclude=history[user.id] | exclude_servers,
+            counts=counts)
+        if server is None:
+            failed.append(user)
+            continue
+        servers[server.id] = server
+        allocation[server.id].append(user)
+        user_count, capacity = counts[server.id]
+        counts[server.id] = (user_count + 1, capacity)
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        results = dict(zip(
+            allocation.keys(),
+            executor.map(
+                lambda server_id: _new_keys(
+                    servers[server_id], len(allocation[server_id])),
+                allocation.keys())))
+
+    outline_users = []
+    for server_id, server_users in allocation.items():
+        keys = results[server_id]
+        failed.extend(server_users[len(keys):])
+        for user, new_key in zip(server_users, keys):
+            outline_users.append(OutlineUser(
+                user=user,
+                server_id=server_id,
+                outline_key_id=new_key['id'],
+                outline_key=new_key['accessUrl']))
+
+    with transaction.atomic():
+        # Keys may have been issued or revoked while the new keys were
+        # created, so what to revoke is decided from the locked users
+        locked = {
+            user_id: (current_key_id, reputation)
+            for user_id, current_key_id, reputation in (
+                Vpnuser.objects.select_for_update()
+                .filter(id__in=[outline_user.user.id for outline_user in outline_users])
+                .values_list('id', 'current_key', 'reputation'))}
+        # Keys of users deleted meanwhile are left to reconcile_keys
+        outline_users = [
+            outline_user for outline_user in outline_users
+            if outline_user.user.id in locked]
+
+        revocations = []
+        user_counts = Counter(
+            outline_user.server_id for outline_user in outline_users)
+        for key_id, server_id, outline_key_id in OutlineUser.objects.filter(
+                id__in=[key_id for key_id, _ in locked.values()]
+        ).values_list('id', 'server_id', 'outline_key_id'):
+            user_counts[server_id] -= 1
+            revocations.append(KeyRevocation(
+                server_id=server_id,
+                outline_key_id=outline_key_id,
+                outline_user_id=key_id))
+
+        changed_users = []
+        for outline_user in outline_users:
+            user = outline_user.user
+            user.current_key_id, user.reputation = locked[user.id]
+            new_rep = ReputationSystem.after_new_key(user.reputation)
+            if new_rep != user.reputation:
+                user.reputation = new_rep
+                changed_users.append(user)
+
+        OutlineUser.objects.bulk_create(outline_users)
+        KeyRevocation.objects.bulk_create(revocations)
+        Vpnuser.objects.bulk_update(changed_users, ['reputation'])
+        Vpnuser.objects.filter(id__in=locked.keys()).refresh_current_key()
+        update_user_counts(user_counts)
+        invalidate_users(
+            outline_user.user.username for outline_user in outline_users)
+
+    return outline_users, failed
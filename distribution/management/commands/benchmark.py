@@ -0,0 +1,52 @@
+# Copyright 2020 ASL19 Organization
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+
+class Command(BaseCommand):
+    help = 'Measure latency and query counts of every API endpoint'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--requests',
+            type=int,
+            default=100,
+            help='Number of requests per endpoint')
+        parser.add_argument(
+            '--json',
+            action='store_true',
+            help='Print the results as JSON')
+
+    def handle(self, *args, **options):
+        # The harness runs on test doubles, which are not loaded otherwise
+        from distribution.tests.benchmark import run_benchmark
+
+        try:
+            results = run_benchmark(requests=options['requests'])
+        except ValueError as exc:
+            raise CommandError(str(exc))
+
+        if options['json']:
+            self.stdout.write(json.dumps(results, indent=2))
+            return
+
+        self.stdout.write('{:<40} {:>8} {:>8} {:>8} {:>8} {:>8} {:>7}'.format(
+            'endpoint', 'p50 ms', 'p95 ms', 'p99 ms', 'queries', 'max q', 'errors'))
+        for result in results:
+            self.stdout.write(
+                '{endpoint:<40} {p50:>8.2f} {p95:>8.2f} {p99:>8.2f} '
+                '{queries_avg:>8.1f} {queries_max:>8} {errors:>7}'.format(**result))
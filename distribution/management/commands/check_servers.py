@@ -0,0 +1,62 @@
+# Copyright 2020 ASL19 Organization
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import time
+
+from django.core.management.base import BaseCommand
+
+from server.health import check_servers
+from server.models import OutlineServer
+
+
+class Command(BaseCommand):
+    help = 'Probe the Outline API and Prometheus of all active servers'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--timeout',
+            type=float,
+            help='Seconds to wait for each probe')
+        parser.add_argument(
+            '--concurrency',
+            type=int,
+            help='Number of servers to probe at the same time')
+        parser.add_argument(
+            '--loop',
+            action='store_true',
+            help='Keep probing instead of exiting after one round')
+        parser.add_argument(
+            '--interval',
+            type=int,
+            default=30,
+            help='Seconds to wait between rounds in loop mode')
+
+    def handle(self, *args, **options):
+        while True:
+            start = time.monotonic()
+            servers = list(OutlineServer.objects.active())
+            unhealthy = check_servers(
+                servers,
+                timeout=options['timeout'],
+                concurrency=options['concurrency'])
+            for server in unhealthy:
+                self.stdout.write(self.style.ERROR(
+                    'Server {} ({}) is unhealthy: {}'.format(
+                        server.id, server.name, server.health_error)))
+            self.stdout.write(self.style.SUCCESS(
+                'Checked {} servers in {:.1f}s, {} unhealthy'.format(
+                    len(servers), time.monotonic() - start, len(unhealthy))))
+            if not options['loop']:
+                break
+            time.sleep(options['interval'])
@@ -0,0 +1,45 @@
+# Copyright 2020 ASL19 Organization
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from django.core.management.base import BaseCommand
+
+from distribution.transfer import collect_transfers
+from server.models import OutlineServer
+
+
+class Command(BaseCommand):
+    help = 'Update the data transfer of live keys from Prometheus'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--duration',
+            default='30d',
+            help='Prometheus duration to sum the transfer over')
+        parser.add_argument(
+            '--workers',
+            type=int,
+            default=8,
+            help='Number of servers to query in parallel')
+
+    def handle(self, *args, **options):
+        servers = OutlineServer.objects.active()
+        updated, failed = collect_transfers(
+            servers,
+            duration=options['duration'],
+            workers=options['workers'])
+        for server in failed:
+            self.stdout.write(self.style.ERROR(
+                'Error getting data transfer of server {}'.format(server.id)))
+        self.stdout.write(self.style.SUCCESS(
+            'Successfully updated the transfer of {} keys'.format(updated)))
@@ -12,10 +12,17 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-from distribution.models import Vpnuser
+import time
+
 from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Count
 from django.utils import timezone
 
+from distribution.models import Vpnuser, OutlineUser, KeyRevocation
+from distribution.revocation import process_revocations
+from server.allocation import update_user_counts
+
 
 class Command(BaseCommand):
     help = 'Delete users after an specified waiting period'
@@ -25,17 +32,98 @@ class Command(BaseCommand):
             'days',
             type=int,
             help='Number of days to wait before deleting a profile')
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=1000,
+            help='Number of users to delete per transaction')
+        parser.add_argument(
+            '--sleep',
+            type=float,
+            default=0,
+            help='Seconds to wait between batches')
+        parser.add_argument(
+            '--workers',
+            type=int,
+            default=4,
+            help='Number of keys to revoke in parallel')
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='Only report what would be deleted')
+
+    def live_keys(self, user_ids):
+        """
+        Current key of each user that is not queued for revocation yet
+        """
+        key_ids = Vpnuser.objects.filter(
+            id__in=user_ids, current_key__isnull=False).values('current_key')
+        return OutlineUser.objects.filter(
+            id__in=key_ids, revocations__isnull=True)
+
+    def delete_batch(self, user_ids):
+        """
+        Queue the revocation of the users' keys and delete them
+        in one transaction
+        """
+        with transaction.atomic():
+            revocations = [
+                KeyRevocation(
+                    server_id=outline_user.server_id,
+                    outline_key_id=outline_user.outline_key_id,
+                    outline_user=outline_user)
+                for outline_user in self.live_keys(user_ids)]
+            KeyRevocation.objects.bulk_create(revocations)
+            update_user_counts({
+                server_id: -count for server_id, count in
+                Vpnuser.objects.filter(
+                    id__in=user_ids, current_key__isnull=False)
+                .values_list('current_key__server_id')
+                .annotate(count=Count('id')).order_by()})
+            OutlineUser.objects.filter(user_id__in=user_ids).update(user=None)
+            Vpnuser.objects.filter(id__in=user_ids).delete()
+        return len(revocations)
 
     def handle(self, *args, **options):
         days = options['days']
+        batch_size = options['batch_size']
 
         target_date = timezone.now() - timezone.timedelta(days=days)
-        users = Vpnuser.objects.filter(delete_date__lte=target_date)
-        count = users.count()
+        users = Vpnuser.objects.filter(
+            delete_date__lte=target_date).order_by('id')
+        deleted = revoked = 0
+        last_id = 0
+        started = timezone.now()
         try:
-            users.delete()
-            self.stdout.write(self.style.SUCCESS(
-                'Successfully deleted {} users'.format(count)))
+            while True:
+                user_ids = list(
+                    users.filter(id__gt=last_id).values_list('id', flat=True)[:batch_size])
+                if not user_ids:
+                    break
+                if last_id and options['sleep']:
+                    time.sleep(options['sleep'])
+                last_id = user_ids[-1]
+                if options['dry_run']:
+                    revoked += self.live_keys(user_ids).count()
+                else:
+                    revoked += self.delete_batch(user_ids)
+                deleted += len(user_ids)
+                self.stdout.write('{} users processed'.format(deleted))
         except Exception as exc:
             self.stdout.write(self.style.ERROR(
                 'Error during deleting users {}'.format(str(exc))))
+            return
+
+        if options['dry_run']:
+            self.stdout.write(self.style.SUCCESS(
+                'Would delete {} users and revoke {} keys'.format(deleted, revoked)))
+            return
+        self.stdout.write(self.style.SUCCESS(
+            'Successfully deleted {} users'.format(deleted)))
+
+        # Only revoke the keys queued by this run, the revocation
+        # worker takes care of the rest of the outbox
+        removed, failed = process_revocations(
+            workers=options['workers'], created_since=started)
+        self.stdout.write(self.style.SUCCESS(
+            'Revoked {} keys, {} will be retried'.format(removed, failed)))
@@ -0,0 +1,64 @@
+# Copyright 2020 ASL19 Organization
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from django.core.management.base import BaseCommand, CommandError
+
+from distribution.evacuation import (
+    evacuate_server, lock_evacuation, unlock_evacuation)
+from server.models import OutlineServer
+
+
+class Command(BaseCommand):
+    help = 'Move all users of an Outline server to other servers'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'server',
+            type=int,
+            help='Id of the Outline server to evacuate')
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=100,
+            help='Number of users to move per batch')
+        parser.add_argument(
+            '--workers',
+            type=int,
+            default=8,
+            help='Number of Outline servers to create keys on in parallel')
+
+    def progress(self, moved, failed, total, elapsed):
+        rate = moved / elapsed if elapsed else 0
+        self.stdout.write('{}/{} users moved, {} failed ({:.1f} users/s)'.format(
+            moved, total, failed, rate))
+
+    def handle(self, *args, **options):
+        try:
+            server = OutlineServer.objects.get(id=options['server'])
+        except OutlineServer.DoesNotExist:
+            raise CommandError('Server {} does not exist'.format(options['server']))
+
+        if not lock_evacuation(server.id):
+            raise CommandError(
+                'Server {} is already being evacuated'.format(server.id))
+        try:
+            moved, failed = evacuate_server(
+                server,
+                batch_size=options['batch_size'],
+                workers=options['workers'],
+                progress=self.progress)
+        finally:
+            unlock_evacuation(server.id)
+        self.stdout.write(self.style.SUCCESS(
+            'Successfully moved {} users, {} failed'.format(moved, failed)))
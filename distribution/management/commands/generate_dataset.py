@@ -0,0 +1,104 @@
+# Copyright 2020 ASL19 Organization
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import random
+from itertools import cycle
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Count
+from model_bakery import baker
+from model_bakery.recipe import seq
+
+from distribution.models import Vpnuser, OutlineUser
+from server.allocation import update_user_counts
+from server.models import OutlineServer
+
+
+class Command(BaseCommand):
+    help = 'Generate synthetic users, servers and keys for benchmarks'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--users',
+            type=int,
+            default=1000,
+            help='Number of users to generate')
+        parser.add_argument(
+            '--servers',
+            type=int,
+            default=20,
+            help='Number of Outline servers to generate')
+        parser.add_argument(
+            '--keys',
+            type=int,
+            default=5000,
+            help='Number of historical keys to generate')
+        parser.add_argument(
+            '--prefix',
+            default='bench',
+            help='Prefix of generated user and server names')
+
+    def handle(self, *args, **options):
+        prefix = options['prefix']
+        channels = ['TG', 'EM']
+        with transaction.atomic():
+            OutlineServer.objects.bulk_create(baker.prepare(
+                OutlineServer,
+                _quantity=options['servers'],
+                name=seq('{}-server-'.format(prefix)),
+                ipv4='127.0.0.1',
+                api_url=seq('https://127.0.0.1/{}-'.format(prefix)),
+                api_cert='',
+                user_src=cycle(channels),
+                level=0,
+                active=True,
+                is_distributing=True))
+            Vpnuser.objects.bulk_create(baker.prepare(
+                Vpnuser,
+                _quantity=options['users'],
+                username=seq('{}_user_'.format(prefix)),
+                channel=cycle(channels),
+                reputation=0,
+                banned=False,
+                delete_date=None), batch_size=1000)
+
+            servers = {
+                channel: list(OutlineServer.objects.filter(
+                    name__startswith=prefix, user_src=channel))
+                for channel in channels}
+            users = list(Vpnuser.objects.filter(
+                username__startswith=prefix).values_list('id', 'channel'))
+            keys = []
+            for key_id in range(options['keys'] if users else 0):
+                user_id, channel = random.choice(users)
+                if not servers[channel]:
+                    continue
+                keys.append(OutlineUser(
+                    user_id=user_id,
+                    server=random.choice(servers[channel]),
+                    outline_key_id=key_id,
+                    outline_key='ss://{}-key-{}'.format(prefix, key_id)))
+            OutlineUser.objects.bulk_create(keys, batch_size=1000)
+            Vpnuser.objects.filter(
+                username__startswith=prefix).refresh_current_key()
+            update_user_counts(dict(
+                Vpnuser.objects.filter(
+                    username__startswith=prefix, current_key__isnull=False)
+                .values_list('current_key__server_id')
+                .annotate(count=Count('id')).order_by()))
+
+        self.stdout.write(self.style.SUCCESS(
+            'Successfully generated {} users, {} servers and {} keys'.format(
+                options['users'], options['servers'], options['keys'])))
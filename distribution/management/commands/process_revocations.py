@@ -0,0 +1,56 @@
+# Copyright 2020 ASL19 Organization
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import time
+
+from django.core.management.base import BaseCommand
+
+from distribution.revocation import process_revocations
+
+
+class Command(BaseCommand):
+    help = 'Remove replaced keys from their Outline servers'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--workers',
+            type=int,
+            default=4,
+            help='Number of keys to remove in parallel')
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=50,
+            help='Number of queued keys to claim at once')
+        parser.add_argument(
+            '--loop',
+            action='store_true',
+            help='Keep polling the queue instead of exiting when it is empty')
+        parser.add_argument(
+            '--interval',
+            type=int,
+            default=10,
+            help='Seconds to wait between polls in loop mode')
+
+    def handle(self, *args, **options):
+        while True:
+            removed, failed = process_revocations(
+                workers=options['workers'],
+                batch_size=options['batch_size'])
+            if removed or failed:
+                self.stdout.write(self.style.SUCCESS(
+                    'Removed {} keys, {} failed'.format(removed, failed)))
+            if not options['loop']:
+                break
+            time.sleep(options['interval'])
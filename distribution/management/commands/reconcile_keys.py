@@ -0,0 +1,77 @@
+# Copyright 2020 ASL19 Organization
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from django.core.management.base import BaseCommand
+
+from distribution.reconciliation import find_orphans, revoke_orphans
+from server.models import OutlineServer
+
+
+class Command(BaseCommand):
+    help = 'Revoke keys on Outline servers that no user owns'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'servers',
+            nargs='*',
+            type=int,
+            help='Ids of the servers to reconcile, all active servers by default')
+        parser.add_argument(
+            '--workers',
+            type=int,
+            default=8,
+            help='Number of servers to list or keys to revoke in parallel')
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=50,
+            help='Number of orphaned keys to claim at once')
+        parser.add_argument(
+            '--wait',
+            type=float,
+            help='Seconds between the two listings of the servers')
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='Only report the orphaned keys')
+
+    def handle(self, *args, **options):
+        servers = OutlineServer.objects.active()
+        if options['servers']:
+            servers = OutlineServer.objects.filter(id__in=options['servers'])
+
+        reports = find_orphans(
+            servers, workers=options['workers'], wait=options['wait'])
+        for report in reports:
+            self.stdout.write('Server {} ({}): {} keys, {} known, {} orphaned'.format(
+                report.server.id,
+                report.server.name,
+                report.listed,
+                report.known,
+                len(report.orphans)))
+        orphans = sum(len(report.orphans) for report in reports)
+
+        if options['dry_run']:
+            self.stdout.write(self.style.SUCCESS(
+                'Would revoke {} orphaned keys on {} servers'.format(
+                    orphans, len(reports))))
+            return
+
+        removed, failed = revoke_orphans(
+            reports,
+            workers=options['workers'],
+            batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(
+            'Found {} orphaned keys, revoked {}, {} will be retried'.format(
+                orphans, removed, failed)))
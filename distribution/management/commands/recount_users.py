@@ -0,0 +1,39 @@
+# Copyright 2020 ASL19 Organization
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from django.core.management.base import BaseCommand
+from django.db.models import Count, F, IntegerField, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+from distribution.models import Vpnuser
+from server.allocation import invalidate_allocation_index
+from server.models import OutlineServer
+
+
+class Command(BaseCommand):
+    help = 'Recount the users of every server from their current keys'
+
+    def handle(self, *args, **options):
+        user_count = Vpnuser.objects.filter(
+            current_key__server=OuterRef('pk')).order_by().values(
+                'current_key__server').annotate(count=Count('id')).values('count')
+        updated = OutlineServer.objects.update(user_count=Coalesce(
+            Subquery(user_count, output_field=IntegerField()), 0))
+        full = OutlineServer.objects.distributing().filter(
+            capacity__isnull=False,
+            user_count__gte=F('capacity')).update(is_distributing=False)
+        invalidate_allocation_index()
+
+        self.stdout.write(self.style.SUCCESS(
+            'Recounted the users of {} servers, {} are full'.format(updated, full)))
@@ -0,0 +1,61 @@
+# Copyright 2020 ASL19 Organization
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db.models import Count
+
+from distribution.models import PooledKey
+from server.clients import get_client
+from server.models import OutlineServer
+
+
+class Command(BaseCommand):
+    help = 'Pre-create unassigned keys on distributing Outline servers'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--size',
+            type=int,
+            default=getattr(settings, 'OUTLINE_KEY_POOL_SIZE', 0),
+            help='Number of spare keys to keep on each server')
+
+    def handle(self, *args, **options):
+        size = options['size']
+        servers = OutlineServer.objects.active().distributing().annotate(
+            pool_size=Count('pooled_keys'))
+
+        created = 0
+        for server in servers:
+            missing = size - server.pool_size
+            if missing <= 0:
+                continue
+            client = get_client(server)
+            for _ in range(missing):
+                # Save each key right away so reconciliation sees it
+                try:
+                    new_key = client.new()
+                    PooledKey.objects.create(
+                        server=server,
+                        outline_key_id=new_key['id'],
+                        outline_key=new_key['accessUrl'])
+                except Exception as exc:
+                    self.stdout.write(self.style.ERROR(
+                        'Error creating key on server {} ({})'.format(
+                            server.id, str(exc))))
+                    break
+                created += 1
+
+        self.stdout.write(self.style.SUCCESS(
+            'Successfully added {} keys to the pool'.format(created)))
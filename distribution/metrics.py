@@ -0,0 +1,215 @@
+# Copyright 2020 ASL19 Organization
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import threading
+import time
+from bisect import bisect_left
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connection
+from django.http import Http404, HttpResponse, HttpResponseForbidden
+from rest_framework.exceptions import APIException
+from rest_framework.request import Request
+from rest_framework.settings import api_settings
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+
+def metrics_enabled():
+    return getattr(settings, 'DISTRIBUTION_METRICS', False)
+
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join(
+        '{}="{}"'.format(name, str(value).replace('\\', '\\\\').replace(
+            '"', '\\"').replace('\n', '\\n'))
+        for name, value in labels) + '}'
+
+
+class Counter(object):
+    """
+    Counter metric with labels
+    """
+    kind = 'counter'
+
+    def __init__(self, name, documentation, labelnames):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self.values = {}
+        self.lock = threading.Lock()
+
+    def inc(self, labels, amount=1):
+        with self.lock:
+            self.values[labels] = self.values.get(labels, 0) + amount
+
+    def samples(self):
+        with self.lock:
+            values = dict(self.values)
+        for labels, value in sorted(values.items()):
+            yield self.name, zip(self.labelnames, labels), value
+
+
+class Histogram(object):
+    """
+    Histogram metric with labels
+    """
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labelnames, buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self.buckets = buckets
+        self.values = {}
+        self.lock = threading.Lock()
+
+    def observe(self, labels, value):
+        index = bisect_left(self.buckets, value)
+        with self.lock:
+            counts, total = self.values.get(
+                labels, ([0] * (len(self.buckets) + 1), 0.0))
+            counts[index] += 1
+            self.values[labels] = (counts, total + value)
+
+    def samples(self):
+        with self.lock:
+            values = {
+                labels: (list(counts), total)
+                for labels, (counts, total) in self.values.items()}
+        for labels, (counts, total) in sorted(values.items()):
+            named = list(zip(self.labelnames, labels))
+            cumulative = 0
+            for bound, count in zip(self.buckets + ('+Inf', ), counts):
+                cumulative += count
+                yield self.name + '_bucket', named + [('le', bound)], cumulative
+            yield self.name + '_sum', named, total
+            yield self.name + '_count', named, cumulative
+
+
+REQUEST_DURATION = Histogram(
+    'distribution_request_duration_seconds',
+    'Request latency by view and method',
+    ('view', 'method'))
+REQUEST_QUERIES = Counter(
+    'distribution_request_db_queries_total',
+    'Database queries issued by requests',
+    ('view', 'method'))
+REQUEST_QUERY_TIME = Counter(
+    'distribution_request_db_query_seconds_total',
+    'Time spent in database queries by requests',
+    ('view', 'method'))
+UPSTREAM_DURATION = Histogram(
+    'distribution_upstream_duration_seconds',
+    'Time spent in Outline and Prometheus API calls',
+    ('service', 'operation'))
+
+REGISTRY = [REQUEST_DURATION, REQUEST_QUERIES, REQUEST_QUERY_TIME, UPSTREAM_DURATION]
+
+
+def record_upstream(sender, service, operation, duration, **kwargs):
+    """
+    Record the duration of a call timed by server.upstream
+    """
+    if metrics_enabled():
+        UPSTREAM_DURATION.observe((service, operation), duration)
+
+
+def render_metrics(registry=REGISTRY):
+    """
+    Render the metrics in the Prometheus text format
+    """
+    lines = []
+    for metric in registry:
+        lines.append('# HELP {} {}'.format(metric.name, metric.documentation))
+        lines.append('# TYPE {} {}'.format(metric.name, metric.kind))
+        for name, labels, value in metric.samples():
+            lines.append('{}{} {}'.format(name, _format_labels(labels), value))
+    return '\n'.join(lines) + '\n'
+
+
+def metrics_allowed(request):
+    """
+    Allow scrapes from DISTRIBUTION_METRICS_ALLOWED_IPS and from staff
+    users authenticated with the API's authentication classes
+    """
+    allowed_ips = getattr(
+        settings, 'DISTRIBUTION_METRICS_ALLOWED_IPS', ('127.0.0.1', '::1'))
+    if request.META.get('REMOTE_ADDR') in allowed_ips:
+        return True
+    request = Request(
+        request,
+        authenticators=[
+            auth() for auth in api_settings.DEFAULT_AUTHENTICATION_CLASSES])
+    try:
+        return bool(request.user and request.user.is_staff)
+    except APIException:
+        return False
+
+
+def metrics_view(request):
+    """
+    Expose the metrics of this process to Prometheus.
+
+    Metrics are kept in memory by each process, so behind several
+    workers every scrape only sees the totals of the worker that
+    answered it. Scrape each worker on its own address, or run a
+    single worker per metrics endpoint, to get consistent totals.
+    """
+    if not metrics_enabled():
+        raise Http404
+    if not metrics_allowed(request):
+        return HttpResponseForbidden()
+    return HttpResponse(
+        render_metrics(),
+        content_type='text/plain; version=0.0.4; charset=utf-8')
+
+
+class MetricsMiddleware(object):
+    """
+    Record latency and database usage of each request by view and method.
+    The middleware removes itself unless DISTRIBUTION_METRICS is True.
+    """
+
+    def __init__(self, get_response):
+        if not metrics_enabled():
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+
+    def __call__(self, request):
+        queries = [0, 0.0]
+
+        def count_query(execute, sql, params, many, context):
+            start = time.perf_counter()
+            try:
+                return execute(sql, params, many, context)
+            finally:
+                queries[0] += 1
+                queries[1] += time.perf_counter() - start
+
+        start = time.perf_counter()
+        with connection.execute_wrapper(count_query):
+            response = self.get_response(request)
+        duration = time.perf_counter() - start
+
+        match = getattr(request, 'resolver_match', None)
+        view = (match.url_name or match.view_name) if match else 'unmatched'
+        labels = (view, request.method)
+        REQUEST_DURATION.observe(labels, duration)
+        REQUEST_QUERIES.inc(labels, queries[0])
+        REQUEST_QUERY_TIME.inc(labels, queries[1])
+        return response
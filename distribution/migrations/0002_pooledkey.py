@@ -0,0 +1,31 @@
+# Generated by Django 3.1 on 2026-10-17 07:26
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('server', '0001_initial'),
+        ('distribution', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PooledKey',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created_date', models.DateTimeField(auto_now_add=True)),
+                ('updated_date', models.DateTimeField(auto_now=True)),
+                ('outline_key_id', models.IntegerField()),
+                ('outline_key', models.CharField(max_length=512)),
+                ('server', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='pooled_keys', to='server.outlineserver')),
+            ],
+            options={
+                'verbose_name': 'PooledKey',
+                'verbose_name_plural': 'PooledKeys',
+                'ordering': ['id'],
+            },
+        ),
+    ]
@@ -0,0 +1,36 @@
+# Generated by Django 3.1 on 2026-10-17 07:27
+
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('server', '0001_initial'),
+        ('distribution', '0002_pooledkey'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='KeyRevocation',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created_date', models.DateTimeField(auto_now_add=True)),
+                ('updated_date', models.DateTimeField(auto_now=True)),
+                ('outline_key_id', models.IntegerField()),
+                ('status', models.CharField(choices=[('PE', 'Pending'), ('DO', 'Done'), ('FA', 'Failed')], default='PE', max_length=2)),
+                ('attempts', models.IntegerField(default=0)),
+                ('run_after', models.DateTimeField(default=django.utils.timezone.now)),
+                ('last_error', models.TextField(blank=True, default='')),
+                ('outline_user', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='revocations', to='distribution.outlineuser')),
+                ('server', models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, related_name='revocations', to='server.outlineserver')),
+            ],
+            options={
+                'verbose_name': 'KeyRevocation',
+                'verbose_name_plural': 'KeyRevocations',
+                'ordering': ['run_after'],
+            },
+        ),
+    ]
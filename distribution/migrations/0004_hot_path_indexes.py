@@ -0,0 +1,33 @@
+# Generated by Django 3.1 on 2026-10-17 07:32
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('distribution', '0003_keyrevocation'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='outlineuser',
+            index=models.Index(fields=['user', 'id'], name='outlineuser_user_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='outlineuser',
+            index=models.Index(fields=['user', 'updated_date'], name='outlineuser_user_updated_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='outlineuser',
+            index=models.Index(condition=models.Q(user_issue__isnull=False), fields=['id'], name='outlineuser_issue_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='vpnuser',
+            index=models.Index(condition=models.Q(banned=True), fields=['id'], name='vpnuser_banned_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='vpnuser',
+            index=models.Index(condition=models.Q(delete_date__isnull=False), fields=['delete_date'], name='vpnuser_delete_date_idx'),
+        ),
+    ]
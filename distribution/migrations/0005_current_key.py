@@ -0,0 +1,32 @@
+# Generated by Django 3.1 on 2026-10-17 07:41
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def backfill_current_key(apps, schema_editor):
+    Vpnuser = apps.get_model('distribution', 'Vpnuser')
+    OutlineUser = apps.get_model('distribution', 'OutlineUser')
+    latest_key = OutlineUser.objects.filter(
+        user=models.OuterRef('pk')).order_by('-id').values('id')[:1]
+    Vpnuser.objects.update(current_key=models.Subquery(latest_key))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('distribution', '0004_hot_path_indexes'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='outlineuser',
+            name='outlineuser_user_updated_idx',
+        ),
+        migrations.AddField(
+            model_name='vpnuser',
+            name='current_key',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='distribution.outlineuser'),
+        ),
+        migrations.RunPython(backfill_current_key, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,21 @@
+# Generated by Django 3.1 on 2026-10-17 08:23
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('distribution', '0005_current_key'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='outlineuser',
+            index=models.Index(fields=['updated_date', 'id'], name='outlineuser_updated_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='vpnuser',
+            index=models.Index(fields=['updated_date', 'id'], name='vpnuser_updated_idx'),
+        ),
+    ]
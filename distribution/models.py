@@ -13,6 +13,7 @@
 # limitations under the License.
 
 from django.db import models
+from django.utils import timezone
 from server.models import OutlineServer
 
 
@@ -23,6 +24,35 @@ USER_CHANNEL_CHOICES = (
     ('NA', 'Unknown')
 )
 
+REVOCATION_STATUS_CHOICES = (
+    ('PE', 'Pending'),
+    ('DO', 'Done'),
+    ('FA', 'Failed')
+)
+
+
+class VpnuserQuerySet(models.QuerySet):
+    """
+    Customized Query Sets for Vpn Users
+    """
+
+    def with_outline_key(self):
+        """
+        Join each user's current key
+        """
+        return self.select_related('current_key')
+
+    def refresh_current_key(self):
+        """
+        Point each user at their latest key, for keys that were
+        created without signals (e.g. bulk_create)
+        """
+        latest_key = OutlineUser.objects.filter(
+            user=models.OuterRef('pk')).order_by('-id').values('id')[:1]
+        return self.update(
+            current_key=models.Subquery(latest_key),
+            updated_date=timezone.now())
+
 
 class DatedMixin(models.Model):
     class Meta:
@@ -68,6 +98,29 @@ class Vpnuser(DatedMixin):
         blank=True)
     banned = models.BooleanField(
         default=False)
+    current_key = models.ForeignKey(
+        'OutlineUser',
+        null=True,
+        blank=True,
+        related_name='+',
+        on_delete=models.SET_NULL)
+
+    objects = VpnuserQuerySet.as_manager()
+
+    class Meta(DatedMixin.Meta):
+        indexes = [
+            models.Index(
+                fields=['id'],
+                name='vpnuser_banned_idx',
+                condition=models.Q(banned=True)),
+            models.Index(
+                fields=['delete_date'],
+                name='vpnuser_delete_date_idx',
+                condition=models.Q(delete_date__isnull=False)),
+            models.Index(
+                fields=['updated_date', 'id'],
+                name='vpnuser_updated_idx'),
+        ]
 
     def __str__(self):
         return self.username
@@ -103,6 +156,77 @@ class OutlineUser(DatedMixin):
     class Meta:
         verbose_name = 'OutlineUser'
         verbose_name_plural = 'OutlineUsers'
+        indexes = [
+            models.Index(
+                fields=['user', 'id'],
+                name='outlineuser_user_id_idx'),
+            models.Index(
+                fields=['id'],
+                name='outlineuser_issue_idx',
+                condition=models.Q(user_issue__isnull=False)),
+            models.Index(
+                fields=['updated_date', 'id'],
+                name='outlineuser_updated_idx'),
+        ]
+
+    def __str__(self):
+        return self.outline_key
+
+
+class PooledKey(DatedMixin):
+    """
+    Model definition for pre-created Outline keys that are
+    not assigned to any user yet.
+    """
+    server = models.ForeignKey(
+        OutlineServer,
+        related_name='pooled_keys',
+        on_delete=models.CASCADE)
+    outline_key_id = models.IntegerField()
+    outline_key = models.CharField(
+        max_length=512)
+
+    class Meta:
+        ordering = ['id']
+        verbose_name = 'PooledKey'
+        verbose_name_plural = 'PooledKeys'
 
     def __str__(self):
         return self.outline_key
+
+
+class KeyRevocation(DatedMixin):
+    """
+    Model definition for keys waiting to be removed
+    from their Outline server.
+    """
+    server = models.ForeignKey(
+        OutlineServer,
+        related_name='revocations',
+        on_delete=models.PROTECT)
+    outline_key_id = models.IntegerField()
+    outline_user = models.ForeignKey(
+        OutlineUser,
+        null=True,
+        blank=True,
+        related_name='revocations',
+        on_delete=models.SET_NULL)
+    status = models.CharField(
+        choices=REVOCATION_STATUS_CHOICES,
+        max_length=2,
+        default='PE')
+    attempts = models.IntegerField(
+        default=0)
+    run_after = models.DateTimeField(
+        default=timezone.now)
+    last_error = models.TextField(
+        blank=True,
+        default='')
+
+    class Meta:
+        ordering = ['run_after']
+        verbose_name = 'KeyRevocation'
+        verbose_name_plural = 'KeyRevocations'
+
+    def __str__(self):
+        return '{}/{}'.format(self.server_id, self.outline_key_id)
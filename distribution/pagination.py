@@ -0,0 +1,52 @@
+# Copyright 2020 ASL19 Organization
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from django.utils.dateparse import parse_datetime
+from rest_framework.exceptions import ValidationError
+from rest_framework.filters import BaseFilterBackend
+from rest_framework.pagination import CursorPagination
+from rest_framework.settings import api_settings
+
+
+class KeysetPagination(CursorPagination):
+    """
+    Cursor pagination on id, newest first. When syncing changes with
+    `updated_since` the pages are ordered by updated_date instead, so
+    clients can resume from the last change they have seen.
+    """
+    ordering = '-id'
+    page_size = api_settings.PAGE_SIZE or 100
+    page_size_query_param = 'page_size'
+    max_page_size = 1000
+
+    def get_ordering(self, request, queryset, view):
+        if request.query_params.get(UpdatedSinceFilter.param):
+            return ('updated_date', 'id')
+        return (self.ordering, )
+
+
+class UpdatedSinceFilter(BaseFilterBackend):
+    """
+    Filter against an `updated_since` ISO 8601 datetime in the URL
+    """
+    param = 'updated_since'
+
+    def filter_queryset(self, request, queryset, view):
+        value = request.query_params.get(self.param, None)
+        if not value:
+            return queryset
+        updated_since = parse_datetime(value)
+        if updated_since is None:
+            raise ValidationError({self.param: 'Invalid datetime'})
+        return queryset.filter(updated_date__gte=updated_since)
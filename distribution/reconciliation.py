@@ -0,0 +1,138 @@
+# Copyright 2020 ASL19 Organization
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import logging
+import time
+from collections import defaultdict, namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+
+from distribution.models import Vpnuser, OutlineUser, PooledKey, KeyRevocation
+from distribution.revocation import process_revocations
+from server.clients import get_client
+
+logger = logging.getLogger(__name__)
+
+ServerReport = namedtuple('ServerReport', ['server', 'listed', 'known', 'orphans'])
+
+
+def list_server_keys(server):
+    """
+    Return the ids of all keys on the server
+    """
+    keys = set()
+    for key in get_client(server).all():
+        try:
+            keys.add(int(key['id']))
+        except (KeyError, TypeError, ValueError):
+            continue
+    return keys
+
+
+def known_keys(servers):
+    """
+    Load the keys that should stay on the servers, i.e. current keys of
+    users, pooled keys and keys already queued for revocation, as a
+    dictionary of server id to key ids
+    """
+    server_ids = [server.id for server in servers]
+    known = defaultdict(set)
+    for server_id, key_id in Vpnuser.objects.filter(
+            current_key__server__in=server_ids).values_list(
+                'current_key__server_id', 'current_key__outline_key_id'):
+        known[server_id].add(key_id)
+    for server_id, key_id in PooledKey.objects.filter(
+            server__in=server_ids).values_list('server_id', 'outline_key_id'):
+        known[server_id].add(key_id)
+    for server_id, key_id in KeyRevocation.objects.filter(
+            server__in=server_ids, status='PE').values_list('server_id', 'outline_key_id'):
+        known[server_id].add(key_id)
+    return known
+
+
+def oldest_keys(servers):
+    """
+    Return the lowest key id each server has in the database
+    """
+    server_ids = [server.id for server in servers]
+    oldest = {}
+    for model in (OutlineUser, PooledKey):
+        for server_id, key_id in model.objects.filter(
+                server__in=server_ids).values_list('server_id', 'outline_key_id'):
+            oldest[server_id] = min(oldest.get(server_id, key_id), key_id)
+    return oldest
+
+
+def list_all_keys(servers, workers):
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        return list(executor.map(list_server_keys, servers))
+
+
+def find_orphans(servers, workers=8, wait=None):
+    """
+    List the keys of all servers concurrently twice, wait seconds apart,
+    and diff them against the database loaded after the second listing.
+    A key is only an orphan if both listings have it, so keys of
+    issuances that were in flight during the first listing are committed
+    by then. wait defaults to the longest an issuance can take.
+    Keys older than any key the database knows of on the server, like
+    the default key of the server, are never orphans.
+    Returns a ServerReport for each server.
+    """
+    if wait is None:
+        wait = getattr(
+            settings,
+            'KEY_RECONCILE_WAIT',
+            getattr(settings, 'OUTLINE_ISSUE_BUDGET', 10) +
+            2 * getattr(settings, 'OUTLINE_CLIENT_TIMEOUT', 3))
+    servers = list(servers)
+    first = list_all_keys(servers, workers)
+    time.sleep(wait)
+    second = list_all_keys(servers, workers)
+
+    known = known_keys(servers)
+    oldest = oldest_keys(servers)
+    reports = []
+    for server, first_keys, keys in zip(servers, first, second):
+        orphans = []
+        if server.id in oldest:
+            orphans = sorted(
+                key_id for key_id in (first_keys & keys) - known[server.id]
+                if key_id >= oldest[server.id])
+        reports.append(ServerReport(server, len(keys), len(known[server.id]), orphans))
+    return reports
+
+
+def revoke_orphans(reports, workers=4, batch_size=50):
+    """
+    Queue the revocation of the orphaned keys and process the queue.
+    Returns the number of removed and failed keys.
+    """
+    revocations = []
+    for report in reports:
+        if not report.orphans:
+            continue
+        outline_users = dict(OutlineUser.objects.filter(
+            server=report.server,
+            outline_key_id__in=report.orphans).values_list('outline_key_id', 'id'))
+        revocations.extend(
+            KeyRevocation(
+                server=report.server,
+                outline_key_id=key_id,
+                outline_user_id=outline_users.get(key_id))
+            for key_id in report.orphans)
+    KeyRevocation.objects.bulk_create(revocations, batch_size=500)
+    logger.info('Queued the revocation of {} orphaned keys'.format(len(revocations)))
+    return process_revocations(workers=workers, batch_size=batch_size)
@@ -0,0 +1,146 @@
+# Copyright 2020 ASL19 Organization
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import F
+from django.utils import timezone
+from outline_api import get_key_datatransfer
+
+from distribution.models import KeyRevocation, OutlineUser
+from server.clients import get_client
+from server.upstream import observe_upstream
+
+logger = logging.getLogger(__name__)
+
+
+def enqueue_revocation(outline_user):
+    """
+    Queue the key of an OutlineUser to be removed from its server
+    """
+    return KeyRevocation.objects.create(
+        server_id=outline_user.server_id,
+        outline_key_id=outline_user.outline_key_id,
+        outline_user=outline_user)
+
+
+def claim_revocations(limit, created_since=None):
+    """
+    Lease up to limit due revocations so no other worker picks them up.
+    If created_since is given, only revocations queued since then are leased.
+    """
+    lease = getattr(settings, 'KEY_REVOCATION_LEASE', 300)
+    now = timezone.now()
+    queryset = KeyRevocation.objects.select_for_update(skip_locked=True) \
+        .filter(status='PE', run_after__lte=now)
+    if created_since is not None:
+        queryset = queryset.filter(created_date__gte=created_since)
+    with transaction.atomic():
+        revocations = list(queryset.order_by('run_after')[:limit])
+        KeyRevocation.objects.filter(
+            id__in=[revocation.id for revocation in revocations]).update(
+                attempts=F('attempts') + 1,
+                run_after=now + timedelta(seconds=lease))
+    return list(
+        KeyRevocation.objects.filter(
+            id__in=[revocation.id for revocation in revocations])
+        .select_related('server', 'outline_user'))
+
+
+def revoke(revocation):
+    """
+    Record the final transfer of the key and delete it from its server.
+    Raises an exception if the server did not delete the key.
+    """
+    server = revocation.server
+    outline_user = revocation.outline_user
+    if outline_user is not None:
+        try:
+            with observe_upstream('prometheus', 'key_transfer'):
+                transfer = get_key_datatransfer(
+                    host=server.ipv4,
+                    port=server.prometheus_port,
+                    key=str(revocation.outline_key_id),
+                    duration="30d")
+        except Exception as exc:
+            logger.error('Error in getting data transfer {}'.format(str(exc)))
+            transfer = None
+        if isinstance(transfer, float):
+            OutlineUser.objects.filter(id=outline_user.id).update(
+                transfer=transfer)
+
+    if not get_client(server).delete(revocation.outline_key_id):
+        raise Exception('Server {} did not delete key {}'.format(
+            server.id, revocation.outline_key_id))
+
+
+def process_revocation(revocation):
+    """
+    Run a single revocation and record its outcome.
+    Returns True if the key was removed.
+    """
+    try:
+        revoke(revocation)
+    except Exception as exc:
+        logger.error(exc)
+        max_attempts = getattr(settings, 'KEY_REVOCATION_MAX_ATTEMPTS', 10)
+        if revocation.attempts >= max_attempts:
+            status = 'FA'
+            run_after = timezone.now()
+        else:
+            status = 'PE'
+            backoff = getattr(settings, 'KEY_REVOCATION_BACKOFF', 60)
+            run_after = timezone.now() + timedelta(
+                seconds=backoff * 2 ** (revocation.attempts - 1))
+        KeyRevocation.objects.filter(id=revocation.id).update(
+            status=status,
+            run_after=run_after,
+            last_error=str(exc))
+        return False
+
+    KeyRevocation.objects.filter(id=revocation.id).update(
+        status='DO',
+        last_error='')
+    return True
+
+
+def _process_in_thread(revocation):
+    try:
+        return process_revocation(revocation)
+    finally:
+        connection.close()
+
+
+def process_revocations(workers=4, batch_size=50, created_since=None):
+    """
+    Process due revocations with a pool of worker threads until none is left,
+    only those queued since created_since if it is given.
+    Returns the number of removed and failed keys.
+    """
+    removed = failed = 0
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        while True:
+            revocations = claim_revocations(batch_size, created_since)
+            if not revocations:
+                break
+            for result in executor.map(_process_in_thread, revocations):
+                if result:
+                    removed += 1
+                else:
+                    failed += 1
+    return removed, failed
@@ -12,19 +12,25 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-import random
 import logging
+import time
+from collections import Counter
 
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import transaction
 from rest_framework import serializers
 from rest_framework.validators import UniqueValidator
 from rest_framework.exceptions import APIException
-from outline_api import (
-    Manager as OutlineManager,
-    get_key_datatransfer)
 
-from distribution.models import Vpnuser, OutlineUser, USER_CHANNEL_CHOICES, Issue
+from distribution.models import (
+    Vpnuser, OutlineUser, PooledKey, USER_CHANNEL_CHOICES, Issue)
 from distribution.reputation import ReputationSystem
-from server.models import OutlineServer
+from distribution.revocation import enqueue_revocation
+from server.allocation import candidate_servers, update_user_counts
+from server.aio import AsyncOutlineClient
+from server.breaker import record_failure, record_success
+from server.clients import get_client
 
 logger = logging.getLogger(__name__)
 
@@ -89,19 +95,28 @@ class VpnuserSerializer(serializers.Serializer):
             'banned',
             instance.banned)
 
-        instance.save()
+        instance.save(update_fields=[
+            'username', 'channel', 'reputation', 'banned', 'updated_date'])
         return instance
 
     def get_outline_key(self, user):
         """
         Populate Outline Key
         """
-        try:
-            outline_user = user.outline_keys.latest('updated_date')
-            return outline_user.outline_key
-        except Exception as exc:
-            logger.error(exc)
+        if user.current_key_id is None:
             return ''
+        return user.current_key.outline_key
+
+
+class VpnuserBatchSerializer(VpnuserSerializer):
+    """
+    Serializer for VPN Users registered in a batch.
+    Uniqueness is checked for the whole batch at once.
+    """
+    username = serializers.CharField(
+        required=True,
+        max_length=256,
+        allow_blank=False)
 
 
 class OutlineuserSerializer(serializers.Serializer):
@@ -131,8 +146,8 @@ class OutlineuserSerializer(serializers.Serializer):
 
     def remove_lastkey(self, user, user_issue):
         """
-        Remove users last key from the Outline Server and
-        update its data
+        Mark users last key as replaced and queue its removal
+        from the Outline Server
         """
         if user_issue:
             try:
@@ -141,93 +156,185 @@ class OutlineuserSerializer(serializers.Serializer):
                 logger.error('Invalid issue specified!')
                 user_issue = None
 
-        last_key = OutlineUser.objects.filter(user=user).last()
+        last_key = user.current_key
         if last_key:
-            try:
-                transfer = get_key_datatransfer(
-                    host=last_key.server.ipv4,
-                    port=last_key.server.prometheus_port,
-                    key=str(last_key.outline_key_id),
-                    duration="30d"
-                )
-            except Exception as exc:
-                logger.error('Error in getting data transfer {}'.format(str(exc)))
-                transfer = None
-
             last_key.user_issue = user_issue
-            last_key.transfer = transfer
             last_key.save()
-            try:
-                previous_manager = OutlineManager(
-                    apiurl=last_key.server.api_url,
-                    apicrt=last_key.server.api_cert)
-                previous_manager.delete(last_key.outline_key_id)
-            except Exception as exc:
-                logger.error(exc)
-
-    def get_server(self, user, level):
-        """
-        Get a server based on user's level and channel
-        """
-        last_keys = OutlineUser.objects.filter(user=user).all()
-        last_servers = list(set([last_key.server.id for last_key in last_keys]))
-
-        servers = OutlineServer.objects.filter(
-            active=True,
-            is_distributing=True,
-            level=level,
-            user_src=user.channel).exclude(id__in=last_servers)
-        count = servers.count()
-        if count > 1:
-            server = servers[random.randint(0, count - 1)]
-        else:
-            server = servers.first()
-        return server
+            enqueue_revocation(last_key)
 
-    def create(self, validated_data):
+    def get_servers(self, user, level):
         """
-        Create and return a new OutlineUser instance, given the validated data.
+        Get the candidate servers based on user's level and channel,
+        in the order they should be tried
+        """
+        last_servers = set(
+            OutlineUser.objects.filter(user=user)
+            .values_list('server_id', flat=True)
+            .distinct())
+
+        return candidate_servers(level, user.channel, exclude=last_servers)
+
+    def take_pooled_key(self, server):
+        """
+        Take a pre-created key of the server out of the pool.
+        Returns None if the pool is empty.
+        """
+        with transaction.atomic():
+            pooled_key = PooledKey.objects.select_for_update(
+                skip_locked=True).filter(server=server).first()
+            if pooled_key is None:
+                return None
+            pooled_key.delete()
+        return {
+            'id': pooled_key.outline_key_id,
+            'accessUrl': pooled_key.outline_key}
+
+    def new_key(self, server):
+        """
+        Take a key from the pool or create one on the server.
+        Returns None if the server failed, which counts towards
+        opening its breaker.
+        """
+        new_key = self.take_pooled_key(server)
+        if new_key is not None:
+            return new_key
+        try:
+            new_key = get_client(server).new()
+            if 'id' not in new_key or 'accessUrl' not in new_key:
+                raise ValueError('Invalid key {}'.format(new_key))
+        except Exception as exc:
+            logger.error('Error getting new key from server {} (Error: {})'.format(server.id, exc))
+            record_failure(server.id)
+            return None
+        record_success(server.id)
+        return new_key
+
+    async def new_key_async(self, server):
+        """
+        Async variant of new_key, awaiting the Outline API
+        instead of blocking the worker
+        """
+        new_key = await sync_to_async(
+            self.take_pooled_key, thread_sensitive=True)(server)
+        if new_key is not None:
+            return new_key
+        async with AsyncOutlineClient(
+                server.api_url,
+                timeout=getattr(settings, 'OUTLINE_CLIENT_TIMEOUT', 3)) as client:
+            new_key = await client.new()
+        if 'id' not in new_key or 'accessUrl' not in new_key:
+            logger.error('Error getting new key from server {}'.format(server.id))
+            await sync_to_async(record_failure, thread_sensitive=True)(server.id)
+            return None
+        await sync_to_async(record_success, thread_sensitive=True)(server.id)
+        return new_key
+
+    def get_user(self, username, lock=False):
+        """
+        Get the user a key is requested for, optionally locking its row
         """
-        user = validated_data.pop('user')
+        queryset = Vpnuser.objects.with_outline_key()
+        if lock:
+            queryset = queryset.select_for_update(of=('self', ))
         try:
-            user = Vpnuser.objects.get(username=user)
+            user = queryset.get(username=username)
         except Vpnuser.DoesNotExist:
             raise NotAcceptable('User does not exist')
 
         if user.banned:
             logger.error('User {} is banned'.format(user))
             raise NotAcceptable('User is banned')
+        return user
 
+    def get_candidates(self, user):
+        """
+        Get the servers to try for the user, raising if there is none
+        """
         level = ReputationSystem.server_level(user.reputation)
-        server = self.get_server(user, level)
-        if server is None:
+        servers = self.get_servers(user, level)
+        if not servers:
             logger.error('Unable to find a new server for user {}'.format(str(user.id)))
             raise NotAcceptable('No server found for user {}'.format(str(user.id)))
+        return servers
 
-        try:
-            manager = OutlineManager(apiurl=server.api_url, apicrt=server.api_cert)
-            new_key = manager.new()
-        except Exception as exc:
-            logger.error('Error getting new key from server {} (Error: {})'.format(server.id, exc))
-            raise NotAcceptable('Outline server error')
-
-        try:
-            validated_data["outline_key_id"] = new_key['id']
-            validated_data["outline_key"] = new_key['accessUrl']
-        except KeyError as exc:
-            logger.error(exc)
-            raise NotAcceptable('Outline key creation error')
+    def save_key(self, user, server, new_key, validated_data):
+        """
+        Save the new key of the user and queue the removal of the last one
+        """
+        validated_data["outline_key_id"] = new_key['id']
+        validated_data["outline_key"] = new_key['accessUrl']
 
         user_issue_id = validated_data.pop('user_issue', None)
         validated_data.pop('transfer', None)
-        self.remove_lastkey(user, user_issue_id)
-        new_rep = ReputationSystem.after_new_key(user.reputation)
-        if new_rep != user.reputation:
-            user.reputation = new_rep
-            user.save()
-
-        return OutlineUser.objects.create(
-            **validated_data, user=user, server=server)
+        user_counts = Counter({server.id: 1})
+        if user.current_key is not None:
+            user_counts[user.current_key.server_id] -= 1
+        with transaction.atomic():
+            self.remove_lastkey(user, user_issue_id)
+            new_rep = ReputationSystem.after_new_key(user.reputation)
+            if new_rep != user.reputation:
+                user.reputation = new_rep
+                user.save()
+
+            outline_user = OutlineUser.objects.create(
+                **validated_data, user=user, server=server)
+            update_user_counts(user_counts)
+            return outline_user
+
+    def create(self, validated_data):
+        """
+        Create and return a new OutlineUser instance, given the validated data.
+        The user's row is locked for the whole issuance, so that concurrent
+        requests of the same user are served one by one.
+        """
+        with transaction.atomic():
+            user = self.get_user(validated_data.pop('user'), lock=True)
+            servers = self.get_candidates(user)
+
+            # Fail over to the next candidate until the budget is spent
+            deadline = time.monotonic() + getattr(settings, 'OUTLINE_ISSUE_BUDGET', 10)
+            new_key = None
+            for server in servers:
+                new_key = self.new_key(server)
+                if new_key is not None or time.monotonic() >= deadline:
+                    break
+            if new_key is None:
+                raise NotAcceptable('Outline server error')
+
+            return self.save_key(user, server, new_key, validated_data)
+
+    async def create_async(self, validated_data):
+        """
+        Async variant of create. The user is only locked while the key
+        is saved, as a transaction can not span the awaited API calls.
+        """
+        username = validated_data.pop('user')
+        user = await sync_to_async(self.get_user, thread_sensitive=True)(username)
+        servers = await sync_to_async(self.get_candidates, thread_sensitive=True)(user)
+
+        deadline = time.monotonic() + getattr(settings, 'OUTLINE_ISSUE_BUDGET', 10)
+        new_key = None
+        for server in servers:
+            new_key = await self.new_key_async(server)
+            if new_key is not None or time.monotonic() >= deadline:
+                break
+        if new_key is None:
+            raise NotAcceptable('Outline server error')
+
+        def save():
+            try:
+                with transaction.atomic():
+                    return self.save_key(
+                        self.get_user(username, lock=True), server, new_key, validated_data)
+            except Exception:
+                # The key is already out of the pool or on the server,
+                # keep it for the next user instead of losing track of it
+                PooledKey.objects.create(
+                    server=server,
+                    outline_key_id=new_key['id'],
+                    outline_key=new_key['accessUrl'])
+                raise
+        return await sync_to_async(save, thread_sensitive=True)()
 
 
 class IssueSerializer(serializers.ModelSerializer):
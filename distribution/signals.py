@@ -0,0 +1,56 @@
+# Copyright 2020 ASL19 Organization
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+from django.utils import timezone
+
+from distribution.cache import invalidate_users
+from distribution.metrics import record_upstream
+from distribution.models import Vpnuser, OutlineUser
+from server.upstream import upstream_called
+
+upstream_called.connect(record_upstream)
+
+
+@receiver(post_save, sender=Vpnuser)
+@receiver(post_delete, sender=Vpnuser)
+def vpnuser_changed(sender, instance, **kwargs):
+    """
+    Drop the cached data of a changed user
+    """
+    invalidate_users([instance.username])
+
+
+@receiver(post_save, sender=OutlineUser)
+def outline_user_created(sender, instance, created, **kwargs):
+    """
+    Make a newly created key the current key of its owner
+    """
+    if created and instance.user_id is not None:
+        Vpnuser.objects.filter(id=instance.user_id).update(
+            current_key=instance, updated_date=timezone.now())
+
+
+@receiver(post_save, sender=OutlineUser)
+@receiver(post_delete, sender=OutlineUser)
+def outline_user_changed(sender, instance, **kwargs):
+    """
+    Drop the cached data of the owner of a changed key
+    """
+    if instance.user_id is None:
+        return
+    invalidate_users(
+        Vpnuser.objects.filter(id=instance.user_id).values_list(
+            'username', flat=True))
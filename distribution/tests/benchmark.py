@@ -0,0 +1,237 @@
+# Copyright 2020 ASL19 Organization
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import asyncio
+import itertools
+import re
+import time
+from unittest import mock
+
+from asgiref.sync import async_to_sync
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext, override_settings
+from django.urls import URLResolver, get_resolver, resolve
+from rest_framework.test import APIRequestFactory, force_authenticate
+
+from distribution.models import Vpnuser, Issue
+from server import clients
+from server.tests.fakes import FakeAsyncOutlineClient, FakeOutlineClient
+from server.models import OutlineServer
+
+URLCONFS = ('distribution.urls', 'server.urls')
+
+BATCH_SIZE = 10
+
+
+class Endpoint(object):
+    """
+    A benchmarked API call. request is called with a counter before
+    the timer starts and returns the method, path and body of the
+    call to make.
+    """
+
+    def __init__(self, name, urlconf, request):
+        self.name = name
+        self.urlconf = urlconf
+        self.request = request
+
+
+def iter_routes(patterns, prefix=''):
+    """
+    Yield the readable route of every url pattern, e.g.
+    distribution/user/<username>
+    """
+    for pattern in patterns:
+        route = prefix + re.sub(
+            r'\(\?P<(\w+)>[^)]*\)', r'<\1>', str(pattern.pattern)).strip('^$')
+        if isinstance(pattern, URLResolver):
+            yield from iter_routes(pattern.url_patterns, route)
+        else:
+            yield route
+
+
+def get_requests(username, server_id, channel):
+    """
+    Requests to benchmark, by route and method
+    """
+    def new_user(i, name='benchmark_issue'):
+        return Vpnuser.objects.create(
+            username='{}_{}'.format(name, i),
+            channel=channel).username
+
+    def new_users(i):
+        return [
+            new_user(i * BATCH_SIZE + j, 'benchmark_batch_issue')
+            for j in range(BATCH_SIZE)]
+
+    return {
+        'distribution/user/<username>': {
+            'get': lambda i: '/distribution/user/{}'.format(username),
+        },
+        'distribution/user': {
+            'put': lambda i: ('/distribution/user', {
+                'username': 'benchmark_new_{}'.format(i), 'channel': 'TG'}),
+            'delete': lambda i: ('/distribution/user', {'username': username}),
+        },
+        'distribution/outline': {
+            'put': lambda i: ('/distribution/outline', {'user': new_user(i)}),
+        },
+        'distribution/outline/<user>': {
+            'get': lambda i: '/distribution/outline/{}'.format(username),
+        },
+        'distribution/users': {
+            'get': lambda i: '/distribution/users',
+        },
+        'distribution/users/batch': {
+            'post': lambda i: ('/distribution/users/batch', [
+                {'username': 'benchmark_batch_{}_{}'.format(i, j), 'channel': 'TG'}
+                for j in range(BATCH_SIZE)]),
+        },
+        'distribution/listoutlineusers': {
+            'get': lambda i: '/distribution/listoutlineusers',
+            'post': lambda i: ('/distribution/listoutlineusers', {'user': new_user(i)}),
+        },
+        'distribution/listoutlineusers/batch': {
+            'post': lambda i: (
+                '/distribution/listoutlineusers/batch', {'users': new_users(i)}),
+        },
+        'distribution/listoutlineusers/async': {
+            'post': lambda i: (
+                '/distribution/listoutlineusers/async',
+                {'user': new_user(i, 'benchmark_async_issue')}),
+        },
+        'distribution/issues': {
+            'get': lambda i: '/distribution/issues',
+        },
+        'metrics': {
+            'get': lambda i: '/metrics',
+        },
+        'server/outlineserver': {
+            'put': lambda i: ('/server/outlineserver', {
+                'name': 'benchmark-new-{}'.format(i),
+                'ipv4': '127.0.0.1',
+                'api_url': 'https://127.0.0.1/benchmark-new-{}'.format(i),
+                'api_cert': 'benchmark'}),
+        },
+        'server/outlineserver/<pk>': {
+            'get': lambda i: '/server/outlineserver/{}'.format(server_id),
+        },
+    }
+
+
+def get_endpoints(username, server_id, channel):
+    """
+    Every route of the distribution and server apps, with the
+    requests of get_requests. Raises ValueError if a route has no
+    request to benchmark or a request matches no route, so new
+    endpoints can't be left out.
+    """
+    requests = get_requests(username, server_id, channel)
+    endpoints = []
+    for urlconf in URLCONFS:
+        for route in iter_routes(get_resolver(urlconf).url_patterns):
+            if route not in requests:
+                raise ValueError('No benchmark request for {}'.format(route))
+            for method, request in requests.pop(route).items():
+                endpoints.append(Endpoint(
+                    '{} {}'.format(method.upper(), route),
+                    urlconf,
+                    lambda i, method=method, request=request:
+                        (method, ) + _path_and_data(request(i))))
+    if requests:
+        raise ValueError('No route for benchmark requests of {}'.format(
+            ', '.join(sorted(requests))))
+    return endpoints
+
+
+def _path_and_data(request):
+    if isinstance(request, str):
+        return request, None
+    return request
+
+
+def percentile(values, percent):
+    values = sorted(values)
+    index = min(len(values) - 1, int(round(percent / 100.0 * (len(values) - 1))))
+    return values[index]
+
+
+def run_endpoint(endpoint, requests, auth_user):
+    """
+    Call the endpoint requests times and return its latency
+    percentiles in milliseconds and its query counts
+    """
+    factory = APIRequestFactory()
+    latencies = []
+    queries = []
+    errors = 0
+    counter = itertools.count()
+    for _ in range(requests):
+        method, path, data = endpoint.request(next(counter))
+        match = resolve(path, urlconf=endpoint.urlconf)
+        request = getattr(factory, method)(path, data, format='json')
+        force_authenticate(request, user=auth_user)
+        view = match.func
+        if asyncio.iscoroutinefunction(view):
+            view = async_to_sync(view)
+        with CaptureQueriesContext(connection) as context:
+            start = time.perf_counter()
+            response = view(request, *match.args, **match.kwargs)
+            if hasattr(response, 'render'):
+                response.render()
+            latencies.append((time.perf_counter() - start) * 1000)
+        queries.append(len(context.captured_queries))
+        if response.status_code >= 400:
+            errors += 1
+
+    return {
+        'endpoint': endpoint.name,
+        'requests': requests,
+        'errors': errors,
+        'p50': percentile(latencies, 50),
+        'p95': percentile(latencies, 95),
+        'p99': percentile(latencies, 99),
+        'queries_avg': sum(queries) / len(queries),
+        'queries_max': max(queries),
+    }
+
+
+def run_benchmark(requests=100, auth_user=None):
+    """
+    Benchmark every endpoint against the current database with an
+    in-process fake Outline API. All changes are rolled back.
+    """
+    auth_user = auth_user or mock.Mock(is_authenticated=True)
+    results = []
+    with mock.patch.object(clients, 'OutlineClient', FakeOutlineClient), \
+            mock.patch(
+                'distribution.serializers.AsyncOutlineClient',
+                FakeAsyncOutlineClient), \
+            override_settings(DISTRIBUTION_METRICS=True), \
+            transaction.atomic():
+        clients._clients.clear()
+        user = Vpnuser.objects.filter(
+            banned=False, outline_keys__isnull=False).first()
+        server = OutlineServer.objects.active().distributing().first()
+        if user is None or server is None:
+            raise ValueError('No user with a key or distributing server to benchmark')
+        Issue.objects.get_or_create(title='benchmark', description='benchmark')
+
+        for endpoint in get_endpoints(user.username, server.id, server.user_src):
+            sid = transaction.savepoint()
+            results.append(run_endpoint(endpoint, requests, auth_user))
+            transaction.savepoint_rollback(sid)
+        transaction.set_rollback(True)
+    clients._clients.clear()
+    return results
@@ -0,0 +1,1381 @@
+# Copyright 2020 ASL19 Organization
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import gzip
+import io
+import json
+import re
+from datetime import timedelta
+from unittest import mock
+
+from django.contrib.admin.sites import AdminSite
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.management import CommandError, call_command
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from model_bakery import baker
+from rest_framework.test import APIClient
+
+from distribution.cache import CACHE_REQUESTS
+from distribution.issuance import issue_keys
+from distribution.models import (
+    Vpnuser, OutlineUser, PooledKey, KeyRevocation, Issue)
+from distribution.evacuation import (
+    evacuate_server, lock_evacuation, unlock_evacuation, users_on_server)
+from distribution.reconciliation import find_orphans, revoke_orphans
+from distribution.revocation import claim_revocations, process_revocation
+from distribution.transfer import collect_transfers
+from distribution.serializers import OutlineuserSerializer, NotAcceptable
+from server.admin import OutlineServerAdmin, _evacuate
+from server.tests.fakes import FakeOutlineServer, FakePrometheus
+from server.allocation import build_allocation_index
+from server.models import OutlineServer
+from server.upstream import observe_upstream
+
+
+def fake_client():
+    """
+    Mocked Outline client that hands out unique keys
+    """
+    client = mock.Mock()
+    ids = iter(range(1000, 100000))
+
+    def new():
+        key_id = next(ids)
+        return {'id': str(key_id), 'accessUrl': 'ss://{}'.format(key_id)}
+    client.new.side_effect = new
+    return client
+
+
+class GetServerTest(TestCase):
+    """
+    Tests for picking a server for a new key
+    """
+
+    def setUp(self):
+        cache.clear()
+        self.servers = baker.make(
+            OutlineServer,
+            active=True,
+            is_distributing=True,
+            level=0,
+            user_src='TG',
+            _quantity=5)
+        self.serializer = OutlineuserSerializer()
+
+    def make_history(self, user, count):
+        baker.make(
+            OutlineUser,
+            user=user,
+            server=self.servers[0],
+            _quantity=count)
+
+    def test_excludes_previous_servers(self):
+        user = baker.make(Vpnuser, channel='TG')
+        for server in self.servers[:4]:
+            baker.make(OutlineUser, user=user, server=server)
+        for _ in range(10):
+            self.assertEqual(
+                self.serializer.get_servers(user, 0), [self.servers[4]])
+
+    def test_no_server_left(self):
+        user = baker.make(Vpnuser, channel='TG')
+        for server in self.servers:
+            baker.make(OutlineUser, user=user, server=server)
+        self.assertEqual(self.serializer.get_servers(user, 0), [])
+
+    def test_query_count_independent_of_history(self):
+        short_history = baker.make(Vpnuser, channel='TG')
+        long_history = baker.make(Vpnuser, channel='TG')
+        self.make_history(short_history, 1)
+        self.make_history(long_history, 300)
+        self.serializer.get_servers(short_history, 0)
+
+        for user in (short_history, long_history):
+            with self.assertNumQueries(1):
+                servers = self.serializer.get_servers(user, 0)
+            self.assertNotIn(self.servers[0], servers)
+
+
+class KeyPoolTest(TestCase):
+    """
+    Tests for issuing keys from the pre-created pool
+    """
+
+    def setUp(self):
+        cache.clear()
+        self.server = baker.make(
+            OutlineServer,
+            active=True,
+            is_distributing=True,
+            level=0,
+            user_src='TG')
+        self.user = baker.make(Vpnuser, channel='TG')
+
+    @mock.patch('distribution.serializers.get_client')
+    def test_takes_key_from_pool(self, client):
+        baker.make(
+            PooledKey,
+            server=self.server,
+            outline_key_id=7,
+            outline_key='ss://pooled')
+        key = OutlineuserSerializer().create({'user': self.user.username})
+        self.assertEqual(key.outline_key, 'ss://pooled')
+        self.assertFalse(PooledKey.objects.exists())
+        client.return_value.new.assert_not_called()
+
+    @mock.patch('distribution.serializers.get_client')
+    def test_falls_back_to_server(self, client):
+        client.return_value.new.return_value = {
+            'id': '3', 'accessUrl': 'ss://live'}
+        key = OutlineuserSerializer().create({'user': self.user.username})
+        self.assertEqual(key.outline_key, 'ss://live')
+        client.return_value.new.assert_called_once()
+
+
+@override_settings(SERVER_BREAKER_THRESHOLD=2)
+class FailoverTest(TestCase):
+    """
+    Tests for failing over to other servers when a server fails
+    """
+
+    def setUp(self):
+        cache.clear()
+        self.dead, self.live = baker.make(
+            OutlineServer,
+            active=True,
+            is_distributing=True,
+            level=0,
+            user_src='TG',
+            _quantity=2)
+        self.clients = {self.dead.id: mock.Mock(), self.live.id: fake_client()}
+        self.clients[self.dead.id].new.side_effect = ConnectionError
+
+    def get_client(self, server):
+        return self.clients[server.id]
+
+    def issue(self):
+        user = baker.make(Vpnuser, channel='TG')
+        return OutlineuserSerializer().create({'user': user.username})
+
+    @mock.patch('distribution.serializers.get_client')
+    def test_fails_over_and_opens_breaker(self, client):
+        client.side_effect = self.get_client
+        for _ in range(10):
+            self.assertEqual(self.issue().server, self.live)
+        self.assertEqual(self.clients[self.dead.id].new.call_count, 2)
+
+    @mock.patch('distribution.serializers.candidate_servers')
+    @mock.patch('distribution.serializers.get_client')
+    def test_budget_stops_failover(self, client, candidates):
+        client.side_effect = self.get_client
+        candidates.return_value = [self.dead, self.live]
+        with override_settings(OUTLINE_ISSUE_BUDGET=0):
+            with self.assertRaises(NotAcceptable):
+                self.issue()
+        self.assertEqual(self.issue().server, self.live)
+
+
+class RevocationTest(TestCase):
+    """
+    Tests for the queue of keys to remove from servers
+    """
+
+    def setUp(self):
+        cache.clear()
+        self.server = baker.make(
+            OutlineServer,
+            active=True,
+            is_distributing=True,
+            level=0,
+            user_src='TG')
+        self.user = baker.make(Vpnuser, channel='TG')
+
+    @mock.patch('distribution.serializers.get_client')
+    def test_new_key_queues_previous_key(self, client):
+        old_server = baker.make(OutlineServer)
+        old_key = baker.make(
+            OutlineUser, user=self.user, server=old_server, outline_key_id=4)
+        client.return_value.new.return_value = {
+            'id': '5', 'accessUrl': 'ss://new'}
+        OutlineuserSerializer().create({'user': self.user.username})
+
+        revocation = KeyRevocation.objects.get()
+        self.assertEqual(revocation.outline_user, old_key)
+        self.assertEqual(revocation.server, old_server)
+        self.assertEqual(revocation.outline_key_id, 4)
+
+    @mock.patch('distribution.revocation.get_key_datatransfer')
+    @mock.patch('distribution.revocation.get_client')
+    def test_process_revocation(self, client, datatransfer):
+        outline_user = baker.make(
+            OutlineUser, server=self.server, outline_key_id=4, transfer=10.0)
+        baker.make(
+            KeyRevocation,
+            server=self.server,
+            outline_key_id=4,
+            outline_user=outline_user)
+        client.return_value.delete.return_value = True
+        datatransfer.return_value = 1024.0
+
+        revocation, = claim_revocations(10)
+        self.assertTrue(process_revocation(revocation))
+        client.return_value.delete.assert_called_once_with(4)
+        outline_user.refresh_from_db()
+        self.assertEqual(outline_user.transfer, 1024.0)
+        self.assertEqual(KeyRevocation.objects.get().status, 'DO')
+        self.assertEqual(claim_revocations(10), [])
+
+    @mock.patch('distribution.revocation.get_key_datatransfer')
+    @mock.patch('distribution.revocation.get_client')
+    def test_failed_revocation_is_retried(self, client, datatransfer):
+        baker.make(KeyRevocation, server=self.server, outline_key_id=4)
+        client.return_value.delete.return_value = False
+
+        revocation, = claim_revocations(10)
+        self.assertFalse(process_revocation(revocation))
+        revocation.refresh_from_db()
+        self.assertEqual(revocation.status, 'PE')
+        self.assertEqual(revocation.attempts, 1)
+        self.assertNotEqual(revocation.last_error, '')
+        self.assertEqual(claim_revocations(10), [])
+
+    def test_claim_created_since(self):
+        old = baker.make(KeyRevocation, server=self.server, outline_key_id=4)
+        KeyRevocation.objects.filter(id=old.id).update(
+            created_date=timezone.now() - timedelta(hours=1))
+        new = baker.make(KeyRevocation, server=self.server, outline_key_id=5)
+
+        self.assertEqual(
+            claim_revocations(10, timezone.now() - timedelta(minutes=1)), [new])
+        self.assertEqual(claim_revocations(10), [old])
+
+
+class EvacuationTest(TestCase):
+    """
+    Tests for moving users off a server
+    """
+
+    def setUp(self):
+        cache.clear()
+        self.blocked, self.other = baker.make(
+            OutlineServer,
+            active=True,
+            is_distributing=True,
+            level=0,
+            user_src='TG',
+            _quantity=2)
+        self.users = baker.make(Vpnuser, channel='TG', _quantity=5)
+        for user in self.users:
+            baker.make(OutlineUser, user=user, server=self.blocked)
+
+    @mock.patch('distribution.issuance.get_client')
+    def test_evacuate_server(self, client):
+        client.return_value = fake_client()
+        progress = mock.Mock()
+        moved, failed = evacuate_server(
+            self.blocked, batch_size=2, progress=progress)
+
+        self.assertEqual((moved, failed), (5, 0))
+        self.assertEqual(progress.call_count, 3)
+        self.blocked.refresh_from_db()
+        self.assertFalse(self.blocked.is_distributing)
+        self.assertFalse(users_on_server(self.blocked).exists())
+        for user in self.users:
+            self.assertEqual(
+                OutlineUser.objects.filter(user=user).last().server,
+                self.other)
+        self.assertEqual(
+            KeyRevocation.objects.filter(server=self.blocked).count(), 5)
+
+        self.assertEqual(evacuate_server(self.blocked), (0, 0))
+
+    @mock.patch('distribution.issuance.get_client')
+    def test_failed_keys_are_reported(self, client):
+        client.return_value.new.return_value = {}
+        self.assertEqual(evacuate_server(self.blocked), (0, 5))
+        self.assertEqual(users_on_server(self.blocked).count(), 5)
+        self.assertFalse(KeyRevocation.objects.exists())
+
+    @mock.patch('distribution.issuance.get_client')
+    def test_stale_server_is_not_saved(self, client):
+        client.return_value.new.return_value = {}
+        OutlineServer.objects.filter(id=self.blocked.id).update(
+            user_count=5, health_failures=1)
+        evacuate_server(self.blocked)
+
+        self.blocked.refresh_from_db()
+        self.assertFalse(self.blocked.is_distributing)
+        self.assertEqual(self.blocked.user_count, 5)
+        self.assertEqual(self.blocked.health_failures, 1)
+
+    def test_command_refuses_concurrent_run(self):
+        self.assertTrue(lock_evacuation(self.blocked.id))
+        with self.assertRaises(CommandError):
+            call_command('evacuate_server', self.blocked.id)
+        unlock_evacuation(self.blocked.id)
+        self.assertTrue(lock_evacuation(self.blocked.id))
+
+    @mock.patch('distribution.issuance.get_client')
+    @mock.patch('server.admin.threading')
+    def test_admin_refuses_concurrent_run(self, threading, client):
+        client.return_value = fake_client()
+        thread = threading.Thread
+        model_admin = OutlineServerAdmin(OutlineServer, AdminSite())
+        model_admin.message_user = mock.Mock()
+        queryset = OutlineServer.objects.filter(id=self.blocked.id)
+
+        model_admin.evacuate(mock.Mock(), queryset)
+        model_admin.evacuate(mock.Mock(), queryset)
+        self.assertEqual(thread.call_count, 1)
+
+        with mock.patch('server.admin.connection'):
+            _evacuate(*thread.call_args[1]['args'])
+        self.assertFalse(users_on_server(self.blocked).exists())
+        model_admin.evacuate(mock.Mock(), queryset)
+        self.assertEqual(thread.call_count, 2)
+
+
+class CurrentKeyTest(TestCase):
+    """
+    Tests for maintaining the current key of users
+    """
+
+    def setUp(self):
+        cache.clear()
+        self.servers = baker.make(
+            OutlineServer,
+            active=True,
+            is_distributing=True,
+            level=0,
+            user_src='TG',
+            _quantity=2)
+        self.user = baker.make(Vpnuser, channel='TG')
+        self.first_key = baker.make(
+            OutlineUser, user=self.user, server=self.servers[0])
+        self.user.refresh_from_db()
+
+    @mock.patch('distribution.serializers.get_client')
+    def test_create_replaces_current_key(self, client):
+        client.return_value.new.return_value = {
+            'id': '3', 'accessUrl': 'ss://live'}
+        key = OutlineuserSerializer().create({'user': self.user.username})
+
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.current_key, key)
+        self.assertEqual(
+            KeyRevocation.objects.get().outline_user, self.first_key)
+
+    @mock.patch('distribution.issuance.get_client')
+    def test_issue_keys_replaces_current_key(self, client):
+        client.return_value = fake_client()
+        issue_keys([self.user])
+
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.current_key.server, self.servers[1])
+        self.assertEqual(
+            KeyRevocation.objects.get().outline_user, self.first_key)
+
+    @mock.patch('distribution.issuance.ThreadPoolExecutor')
+    @mock.patch('distribution.issuance.get_client')
+    def test_issue_keys_revokes_key_issued_meanwhile(self, client, executor):
+        # Create the keys in this thread, which sees the test's data
+        executor.return_value.__enter__.return_value.map = map
+        client.return_value = fake_client()
+        new = client.return_value.new.side_effect
+        concurrent = []
+
+        def new_during_create():
+            concurrent.append(baker.make(
+                OutlineUser, user=self.user, server=self.servers[0]))
+            return new()
+        client.return_value.new.side_effect = new_during_create
+        issue_keys([self.user])
+
+        self.assertEqual(
+            KeyRevocation.objects.get().outline_user, concurrent[0])
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.current_key.server, self.servers[1])
+
+    def test_refresh_current_key(self):
+        Vpnuser.objects.update(current_key=None)
+        Vpnuser.objects.refresh_current_key()
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.current_key, self.first_key)
+
+
+class UserCountTest(TestCase):
+    """
+    Tests for maintaining the number of users of servers
+    """
+
+    def setUp(self):
+        cache.clear()
+        self.old, self.new = baker.make(
+            OutlineServer,
+            active=True,
+            is_distributing=True,
+            level=0,
+            user_src='TG',
+            _quantity=2)
+        self.user = baker.make(Vpnuser, channel='TG')
+        baker.make(OutlineUser, user=self.user, server=self.old)
+        OutlineServer.objects.filter(id=self.old.id).update(user_count=1)
+
+    def assertUserCounts(self, old, new):
+        self.old.refresh_from_db()
+        self.new.refresh_from_db()
+        self.assertEqual((self.old.user_count, self.new.user_count), (old, new))
+
+    @mock.patch('distribution.serializers.get_client')
+    def test_create_moves_user(self, client):
+        client.return_value = fake_client()
+        OutlineuserSerializer().create({'user': self.user.username})
+        self.assertUserCounts(0, 1)
+
+    @mock.patch('distribution.issuance.get_client')
+    def test_issue_keys_moves_user(self, client):
+        client.return_value = fake_client()
+        self.user.refresh_from_db()
+        other = baker.make(Vpnuser, channel='TG')
+        issue_keys([self.user, other], exclude_servers={self.old.id})
+        self.assertUserCounts(0, 2)
+
+    def test_recount(self):
+        OutlineServer.objects.update(user_count=50, capacity=1)
+        call_command('recount_users', stdout=mock.Mock())
+        self.assertUserCounts(1, 0)
+        self.assertFalse(self.old.is_distributing)
+        self.assertTrue(self.new.is_distributing)
+
+
+class TransferTest(TestCase):
+    """
+    Tests for collecting the data transfer of keys
+    """
+
+    def test_collect_transfers(self):
+        with FakePrometheus({1: 100.0, 2: 200.0}) as prometheus:
+            server = baker.make(
+                OutlineServer,
+                ipv4=prometheus.host,
+                prometheus_port=prometheus.port)
+            user = baker.make(Vpnuser)
+            rotated = baker.make(
+                OutlineUser, user=user, server=server, outline_key_id=4, transfer=12345.0)
+            first = baker.make(
+                OutlineUser, user=user, server=server, outline_key_id=1, transfer=None)
+            second = baker.make(
+                OutlineUser, user=baker.make(Vpnuser), server=server,
+                outline_key_id=2, transfer=None)
+            revoked = baker.make(
+                OutlineUser, server=server, outline_key_id=3, transfer=5.0)
+            baker.make(
+                KeyRevocation,
+                server=server,
+                outline_key_id=3,
+                outline_user=revoked)
+            orphan = baker.make(
+                OutlineUser, user=None, server=server, outline_key_id=5, transfer=999.0)
+
+            self.assertEqual(collect_transfers([server]), (2, []))
+
+        self.assertEqual(len(prometheus.requests), 1)
+        for key, transfer in (
+                (first, 100.0), (second, 200.0), (revoked, 5.0),
+                (rotated, 12345.0), (orphan, 999.0)):
+            key.refresh_from_db()
+            self.assertEqual(key.transfer, transfer)
+
+    def test_unreachable_server(self):
+        with FakePrometheus() as prometheus:
+            pass
+        server = baker.make(
+            OutlineServer,
+            ipv4=prometheus.host,
+            prometheus_port=prometheus.port)
+        self.assertEqual(collect_transfers([server]), (0, [server]))
+
+
+@override_settings(ROOT_URLCONF='distribution.urls')
+class ExportTest(TestCase):
+    """
+    Tests for streaming exports of the list endpoints
+    """
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(baker.make(User))
+        server = baker.make(OutlineServer)
+        for name in ('alice', 'bob'):
+            user = baker.make(Vpnuser, username=name, channel='TG')
+            baker.make(
+                OutlineUser,
+                user=user,
+                server=server,
+                outline_key='ss://{}'.format(name))
+
+    def content(self, response):
+        return b''.join(response.streaming_content)
+
+    def test_csv_export(self):
+        response = self.client.get('/distribution/users', {'export': 'csv'})
+        self.assertEqual(response.status_code, 200)
+        lines = self.content(response).decode().splitlines()
+        self.assertEqual(
+            lines[0],
+            'username,channel,reputation,delete_date,banned,outline_key')
+        self.assertIn('bob,TG,0,,False,ss://bob', lines)
+        self.assertEqual(len(lines), 3)
+
+    def test_ndjson_export(self):
+        response = self.client.get(
+            '/distribution/listoutlineusers', {'export': 'ndjson'})
+        rows = [json.loads(line) for line in self.content(response).splitlines()]
+        self.assertEqual(
+            sorted(row['user'] for row in rows), ['alice', 'bob'])
+        self.assertEqual(
+            set(rows[0]),
+            {'user', 'server', 'outline_key', 'reputation', 'transfer', 'user_issue'})
+
+    def test_gzip_export(self):
+        response = self.client.get(
+            '/distribution/users', {'export': 'ndjson', 'gzip': 'true'})
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        lines = gzip.decompress(self.content(response)).splitlines()
+        self.assertEqual(len(lines), 2)
+
+
+@override_settings(ROOT_URLCONF='distribution.urls')
+class UserListTest(TestCase):
+    """
+    Tests for the list of VPN users
+    """
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(baker.make(User))
+        server = baker.make(OutlineServer)
+        users = Vpnuser.objects.bulk_create(
+            Vpnuser(username='user{}'.format(i)) for i in range(1000))
+        users = Vpnuser.objects.order_by('id')
+        OutlineUser.objects.bulk_create(
+            OutlineUser(
+                user=user,
+                server=server,
+                outline_key_id=user.id,
+                outline_key='ss://{}'.format(user.id)) for user in users)
+        Vpnuser.objects.refresh_current_key()
+
+    def test_outline_key_without_extra_queries(self):
+        with self.assertNumQueries(1):
+            response = self.client.get(
+                '/distribution/users', {'format': 'json', 'page_size': 1000})
+        self.assertEqual(response.status_code, 200)
+        data = response.json()['results']
+        self.assertEqual(len(data), 1000)
+        for row in data:
+            self.assertEqual(row['outline_key'], 'ss://{}'.format(row['id']))
+
+    def fetch_all(self, params):
+        usernames = []
+        url = '/distribution/users'
+        while url:
+            response = self.client.get(url, params)
+            self.assertEqual(response.status_code, 200)
+            data = response.json()
+            usernames.extend(row['username'] for row in data['results'])
+            url, params = data['next'], None
+        return usernames
+
+    def test_pages_are_stable_during_inserts(self):
+        first = self.client.get(
+            '/distribution/users', {'format': 'json', 'page_size': 400}).json()
+        Vpnuser.objects.create(username='newcomer')
+        second = self.client.get(first['next']).json()
+        usernames = [row['username'] for row in first['results'] + second['results']]
+        self.assertEqual(len(set(usernames)), 800)
+        self.assertNotIn('newcomer', usernames)
+
+    def test_updated_since(self):
+        user = Vpnuser.objects.get(username='user10')
+        user.reputation = 5
+        user.save()
+        usernames = self.fetch_all({
+            'format': 'json',
+            'updated_since': user.updated_date.isoformat()})
+        self.assertEqual(usernames, ['user10'])
+
+    def test_updated_since_new_key(self):
+        since = timezone.now()
+        baker.make(OutlineUser, user=Vpnuser.objects.get(username='user20'))
+        usernames = self.fetch_all({
+            'format': 'json', 'updated_since': since.isoformat()})
+        self.assertEqual(usernames, ['user20'])
+
+    def test_invalid_updated_since(self):
+        response = self.client.get(
+            '/distribution/users', {'format': 'json', 'updated_since': 'x'})
+        self.assertEqual(response.status_code, 400)
+
+
+@override_settings(ROOT_URLCONF='distribution.urls')
+class QueryPlanTest(TestCase):
+    """
+    Check on a large synthetic dataset that the hot path queries
+    are served from an index instead of a full table scan
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        now = timezone.now()
+        servers = OutlineServer.objects.bulk_create(
+            OutlineServer(
+                name='server{}'.format(i),
+                level=i % 5,
+                user_src='TG' if i % 2 else 'EM',
+                active=i % 3 == 0,
+                is_distributing=i % 4 != 0) for i in range(500))
+        Vpnuser.objects.bulk_create(
+            Vpnuser(
+                username='user{}'.format(i),
+                banned=i % 100 == 0,
+                delete_date=now - timedelta(days=i % 30) if i % 50 == 0 else None)
+            for i in range(20000))
+        servers = list(OutlineServer.objects.all())
+        issue = baker.make(Issue)
+        OutlineUser.objects.bulk_create(
+            OutlineUser(
+                user_id=user_id,
+                server=servers[(user_id + i) % len(servers)],
+                outline_key_id=i,
+                outline_key='ss://{}/{}'.format(user_id, i),
+                user_issue=issue if user_id % 100 == 0 else None)
+            for user_id in Vpnuser.objects.values_list('id', flat=True)
+            for i in range(2))
+        Vpnuser.objects.refresh_current_key()
+        # Only a few rows changed since the last sync
+        month_ago = now - timedelta(days=30)
+        Vpnuser.objects.exclude(id__lte=20).update(updated_date=month_ago)
+        OutlineUser.objects.exclude(id__lte=20).update(updated_date=month_ago)
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE')
+        cls.user = Vpnuser.objects.get(username='user42')
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.client.force_authenticate(baker.make(User))
+
+    def explain(self, sql, params=()):
+        with connection.cursor() as cursor:
+            cursor.execute(
+                '{} {}'.format(connection.ops.explain_query_prefix(), sql), params)
+            return '\n'.join(str(row[-1]) for row in cursor.fetchall())
+
+    def assertIndexScan(self, plan, index_name=None):
+        if index_name is not None:
+            self.assertIn(index_name, plan)
+        for line in plan.splitlines():
+            self.assertNotIn('Seq Scan', line)
+            if re.search(r'\bSCAN\b', line):
+                self.assertIn('INDEX', line, plan)
+
+    def assertQueriesIndexed(self, queries, table, index_name=None):
+        """
+        Check the plans of the captured queries that read the table
+        """
+        selects = [
+            query['sql'] for query in queries
+            if query['sql'].startswith('SELECT')
+            and 'FROM "{}"'.format(table) in query['sql']]
+        self.assertTrue(selects, 'No query on {}'.format(table))
+        for sql in selects:
+            self.assertIndexScan(self.explain(sql), index_name)
+
+    def get(self, url, params=None):
+        """
+        Request the url, or the next page link if params is None,
+        and return the queries it ran
+        """
+        if params is not None:
+            params = dict(params, format='json')
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(url, params)
+        self.assertEqual(response.status_code, 200)
+        return response, context.captured_queries
+
+    def test_user(self):
+        _, queries = self.get('/distribution/user/user42', {})
+        self.assertQueriesIndexed(queries, Vpnuser._meta.db_table)
+
+    def test_outline_user(self):
+        _, queries = self.get('/distribution/outline/user42', {})
+        self.assertQueriesIndexed(queries, Vpnuser._meta.db_table)
+
+    def test_banned_users(self):
+        response, queries = self.get(
+            '/distribution/users', {'banned': 'True'})
+        self.assertQueriesIndexed(
+            queries, Vpnuser._meta.db_table, 'vpnuser_banned_idx')
+
+        _, queries = self.get(response.json()['next'])
+        self.assertQueriesIndexed(
+            queries, Vpnuser._meta.db_table, 'vpnuser_banned_idx')
+
+    def test_users_updated_since(self):
+        response, queries = self.get('/distribution/users', {
+            'updated_since': (timezone.now() - timedelta(minutes=1)).isoformat(),
+            'page_size': 10})
+        self.assertQueriesIndexed(
+            queries, Vpnuser._meta.db_table, 'vpnuser_updated_idx')
+
+        _, queries = self.get(response.json()['next'])
+        self.assertQueriesIndexed(
+            queries, Vpnuser._meta.db_table, 'vpnuser_updated_idx')
+
+    def test_blocked_keys(self):
+        response, queries = self.get(
+            '/distribution/listoutlineusers', {'blocked': 'true', 'page_size': 10})
+        self.assertQueriesIndexed(
+            queries, OutlineUser._meta.db_table, 'outlineuser_issue_idx')
+
+        _, queries = self.get(response.json()['next'])
+        self.assertQueriesIndexed(
+            queries, OutlineUser._meta.db_table, 'outlineuser_issue_idx')
+
+    def test_keys_updated_since(self):
+        response, queries = self.get('/distribution/listoutlineusers', {
+            'updated_since': (timezone.now() - timedelta(minutes=1)).isoformat(),
+            'page_size': 10})
+        self.assertQueriesIndexed(
+            queries, OutlineUser._meta.db_table, 'outlineuser_updated_idx')
+
+    @mock.patch(
+        'distribution.management.commands.delete_users.process_revocations',
+        return_value=(0, 0))
+    def test_users_to_delete(self, process_revocations):
+        with CaptureQueriesContext(connection) as context:
+            call_command('delete_users', 0, batch_size=10, stdout=io.StringIO())
+        self.assertQueriesIndexed(
+            context.captured_queries[:1],
+            Vpnuser._meta.db_table,
+            'vpnuser_delete_date_idx')
+
+    def test_users_on_server(self):
+        server = OutlineUser.objects.get(id=self.user.current_key_id).server
+        sql, params = users_on_server(server).order_by('id')[:100].query.sql_with_params()
+        self.assertIndexScan(self.explain(sql, params))
+
+    def test_distributing_servers(self):
+        with CaptureQueriesContext(connection) as context:
+            build_allocation_index()
+        self.assertQueriesIndexed(
+            context.captured_queries,
+            OutlineServer._meta.db_table,
+            'outlineserver_alloc_idx')
+
+
+@mock.patch(
+    'distribution.management.commands.delete_users.process_revocations',
+    return_value=(0, 0))
+class DeleteUsersTest(TestCase):
+    """
+    Tests for deleting users after their waiting period
+    """
+
+    def setUp(self):
+        server = baker.make(OutlineServer)
+        self.expired = baker.make(
+            Vpnuser,
+            delete_date=timezone.now() - timedelta(days=10),
+            _quantity=5)
+        self.waiting = baker.make(
+            Vpnuser,
+            delete_date=timezone.now() - timedelta(days=1))
+        for user in self.expired + [self.waiting]:
+            baker.make(OutlineUser, user=user, server=server, _quantity=2)
+
+    def test_delete_users(self, process_revocations):
+        call_command('delete_users', '7', batch_size=2, stdout=mock.Mock())
+
+        self.assertEqual(list(Vpnuser.objects.all()), [self.waiting])
+        self.assertEqual(OutlineUser.objects.filter(user__isnull=True).count(), 10)
+        self.assertEqual(KeyRevocation.objects.count(), 5)
+        process_revocations.assert_called_once()
+        created_since = process_revocations.call_args[1]['created_since']
+        self.assertFalse(KeyRevocation.objects.filter(
+            created_date__lt=created_since).exists())
+
+    @mock.patch('distribution.management.commands.delete_users.time.sleep')
+    def test_sleep_between_batches(self, sleep, process_revocations):
+        call_command(
+            'delete_users', '7', batch_size=2, sleep=1, stdout=mock.Mock())
+        # Three batches, no sleep after the last one
+        self.assertEqual(sleep.call_count, 2)
+
+    def test_dry_run(self, process_revocations):
+        call_command('delete_users', '7', dry_run=True, stdout=mock.Mock())
+
+        self.assertEqual(Vpnuser.objects.count(), 6)
+        self.assertFalse(KeyRevocation.objects.exists())
+        process_revocations.assert_not_called()
+
+
+class BenchmarkTest(TestCase):
+    """
+    Smoke test of the dataset generator and the benchmark runner
+    """
+
+    def test_benchmark(self):
+        call_command(
+            'generate_dataset', users=20, servers=4, keys=60, stdout=mock.Mock())
+        self.assertEqual(Vpnuser.objects.count(), 20)
+        self.assertEqual(OutlineUser.objects.count(), 60)
+        self.assertEqual(
+            sum(OutlineServer.objects.values_list('user_count', flat=True)),
+            Vpnuser.objects.filter(current_key__isnull=False).count())
+
+        stdout = mock.Mock()
+        call_command('benchmark', requests=3, json=True, stdout=stdout)
+        results = json.loads(stdout.write.call_args[0][0])
+        self.assertEqual(len(results), 15)
+        endpoints = {result['endpoint'] for result in results}
+        for endpoint in (
+                'POST distribution/users/batch',
+                'POST distribution/listoutlineusers/batch',
+                'POST distribution/listoutlineusers/async',
+                'GET metrics'):
+            self.assertIn(endpoint, endpoints)
+        for result in results:
+            self.assertEqual(result['errors'], 0, result['endpoint'])
+        self.assertEqual(OutlineUser.objects.count(), 60)
+
+
+@override_settings(
+    ROOT_URLCONF='distribution.urls',
+    DISTRIBUTION_METRICS=True,
+    MIDDLEWARE=['distribution.metrics.MetricsMiddleware'])
+class MetricsTest(TestCase):
+    """
+    Tests for the request metrics
+    """
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(baker.make(User))
+
+    def test_metrics(self):
+        baker.make(Vpnuser, username='alice')
+        self.client.get('/distribution/user/alice')
+        response = self.client.get('/metrics')
+
+        self.assertEqual(response.status_code, 200)
+        body = response.content.decode()
+        self.assertIn('# TYPE distribution_request_duration_seconds histogram', body)
+        self.assertRegex(
+            body,
+            r'distribution_request_duration_seconds_count'
+            r'\{view="distribution.views.VpnuserView",method="GET"\} [1-9]')
+        self.assertRegex(
+            body,
+            r'distribution_request_db_queries_total'
+            r'\{view="distribution.views.VpnuserView",method="GET"\} [1-9]')
+
+    @override_settings(DISTRIBUTION_METRICS=False)
+    def test_disabled(self):
+        self.assertEqual(self.client.get('/metrics').status_code, 404)
+
+    def test_remote_scrape_is_forbidden(self):
+        self.client.force_authenticate(None)
+        response = self.client.get('/metrics', REMOTE_ADDR='10.0.0.1')
+        self.assertEqual(response.status_code, 403)
+
+        self.client.force_authenticate(baker.make(User, is_staff=True))
+        response = self.client.get('/metrics', REMOTE_ADDR='10.0.0.1')
+        self.assertEqual(response.status_code, 200)
+
+    @override_settings(DISTRIBUTION_METRICS_ALLOWED_IPS=['10.0.0.1'])
+    def test_allowed_ip(self):
+        self.client.force_authenticate(None)
+        response = self.client.get('/metrics', REMOTE_ADDR='10.0.0.1')
+        self.assertEqual(response.status_code, 200)
+
+    def test_upstream_calls(self):
+        with observe_upstream('outline', 'test'):
+            pass
+        self.assertRegex(
+            self.client.get('/metrics').content.decode(),
+            r'distribution_upstream_duration_seconds_count'
+            r'\{service="outline",operation="test"\} 1')
+
+
+@override_settings(ROOT_URLCONF='distribution.urls')
+class UserBatchTest(TestCase):
+    """
+    Tests for registering users in a batch
+    """
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(baker.make(User))
+        baker.make(Vpnuser, username='existing')
+
+    def test_register_batch(self):
+        users = [
+            {'username': 'user{}'.format(i), 'channel': 'TG'} for i in range(100)]
+        users += [
+            {'username': 'existing', 'channel': 'TG'},
+            {'username': 'user0', 'channel': 'TG'},
+            {'username': 'bad', 'channel': 'XX'}]
+        with self.assertNumQueries(3):
+            response = self.client.post(
+                '/distribution/users/batch', users, format='json')
+
+        self.assertEqual(response.status_code, 200)
+        results = response.json()
+        self.assertEqual(len(results), 103)
+        self.assertEqual(
+            [result['status'] for result in results[99:]],
+            ['created', 'exists', 'exists', 'invalid'])
+        self.assertIn('channel', results[-1]['errors'])
+        self.assertEqual(
+            results[0]['id'], Vpnuser.objects.get(username='user0').id)
+        self.assertEqual(Vpnuser.objects.count(), 101)
+
+    @override_settings(USER_BATCH_MAX_SIZE=2)
+    def test_batch_too_large(self):
+        response = self.client.post(
+            '/distribution/users/batch',
+            [{'username': str(i), 'channel': 'TG'} for i in range(3)],
+            format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(Vpnuser.objects.filter(username='0').exists())
+
+
+@override_settings(ROOT_URLCONF='distribution.urls')
+class KeyBatchTest(TestCase):
+    """
+    Tests for issuing keys to a batch of users
+    """
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.client.force_authenticate(baker.make(User))
+        self.servers = baker.make(
+            OutlineServer,
+            active=True,
+            is_distributing=True,
+            level=0,
+            user_src='TG',
+            _quantity=3)
+
+    @mock.patch('distribution.issuance.get_client')
+    def test_issue_batch(self, client):
+        client.return_value = fake_client()
+        users = baker.make(Vpnuser, channel='TG', _quantity=30)
+        for user in users[:10]:
+            baker.make(OutlineUser, user=user, server=self.servers[0])
+        baker.make(Vpnuser, username='banned', channel='TG', banned=True)
+        usernames = [user.username for user in users] + ['banned', 'nobody']
+
+        response = self.client.post(
+            '/distribution/listoutlineusers/batch',
+            {'users': usernames},
+            format='json')
+
+        self.assertEqual(response.status_code, 200)
+        results = response.json()
+        self.assertEqual(
+            [result['status'] for result in results],
+            ['issued'] * 30 + ['banned', 'not_found'])
+        self.assertEqual(results[0]['user'], users[0].username)
+        self.assertTrue(results[0]['outline_key'].startswith('ss://'))
+        self.assertEqual(client.return_value.new.call_count, 30)
+        self.assertEqual(OutlineUser.objects.count(), 40)
+        self.assertEqual(KeyRevocation.objects.count(), 10)
+        for user in users[:10]:
+            self.assertNotEqual(
+                OutlineUser.objects.filter(user=user).last().server,
+                self.servers[0])
+
+    def test_invalid_batch(self):
+        response = self.client.post(
+            '/distribution/listoutlineusers/batch',
+            {'users': 'alice'},
+            format='json')
+        self.assertEqual(response.status_code, 400)
+
+
+@override_settings(ROOT_URLCONF='distribution.urls')
+@mock.patch('distribution.cache.transaction.on_commit', lambda func: func())
+class ReadCacheTest(TestCase):
+    """
+    Tests for the read-through cache of the user endpoints
+    """
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.client.force_authenticate(baker.make(User))
+        self.server = baker.make(
+            OutlineServer, active=True, is_distributing=True, level=0, user_src='TG')
+        self.user = baker.make(Vpnuser, username='alice', channel='TG')
+
+    def test_user_hit(self):
+        hits = CACHE_REQUESTS.values.get(('user', 'hit'), 0)
+        first = self.client.get('/distribution/user/alice').json()
+        with self.assertNumQueries(0):
+            second = self.client.get('/distribution/user/alice').json()
+
+        self.assertEqual(first, second)
+        self.assertEqual(CACHE_REQUESTS.values[('user', 'hit')], hits + 1)
+
+    def test_user_invalidated_on_save(self):
+        self.client.get('/distribution/user/alice')
+        self.user.reputation = 5
+        self.user.save()
+
+        response = self.client.get('/distribution/user/alice')
+        self.assertEqual(response.json()['reputation'], 5)
+
+    def test_missing_user_not_cached(self):
+        self.assertEqual(
+            self.client.get('/distribution/user/bob').status_code, 404)
+        baker.make(Vpnuser, username='bob')
+        self.assertEqual(
+            self.client.get('/distribution/user/bob').status_code, 200)
+
+    def test_outline_invalidated_on_new_key(self):
+        baker.make(OutlineUser, user=self.user, server=self.server, outline_key='ss://old')
+        self.assertEqual(
+            self.client.get('/distribution/outline/alice').json()['outline_key'],
+            'ss://old')
+        baker.make(OutlineUser, user=self.user, server=self.server, outline_key='ss://new')
+
+        self.assertEqual(
+            self.client.get('/distribution/outline/alice').json()['outline_key'],
+            'ss://new')
+
+    @mock.patch('distribution.issuance.get_client')
+    def test_outline_invalidated_on_batch_issue(self, client):
+        client.return_value = fake_client()
+        self.client.get('/distribution/outline/alice')
+        issue_keys([self.user])
+
+        response = self.client.get('/distribution/outline/alice')
+        self.assertTrue(response.json()['outline_key'].startswith('ss://'))
+
+
+@override_settings(KEY_RECONCILE_WAIT=0)
+class ReconcileTest(TestCase):
+    """
+    Tests for revoking keys that no user owns
+    """
+
+    def setUp(self):
+        self.outline = FakeOutlineServer()
+        self.outline.__enter__()
+        self.addCleanup(self.outline.__exit__)
+        for key_id in range(0, 12):
+            self.outline.add_key(key_id)
+        self.server = baker.make(
+            OutlineServer, api_url=self.outline.api_url, api_cert='fake')
+
+        alice, bob = baker.make(Vpnuser, _quantity=2)
+        baker.make(OutlineUser, user=alice, server=self.server, outline_key_id=1)
+        baker.make(
+            OutlineUser, user=bob, server=self.server, outline_key_id=5, transfer=0)
+        baker.make(OutlineUser, user=bob, server=self.server, outline_key_id=10)
+        baker.make(PooledKey, server=self.server, outline_key_id=3)
+        baker.make(KeyRevocation, server=self.server, outline_key_id=4)
+        baker.make(KeyRevocation, server=self.server, outline_key_id=6, status='FA')
+
+    def test_find_orphans(self):
+        report, = find_orphans([self.server])
+        self.assertEqual(report.listed, 12)
+        self.assertEqual(report.known, 4)
+        # 0 is older than any known key, like the default key of a server
+        self.assertEqual(report.orphans, [2, 5, 6, 7, 8, 9, 11])
+
+    def test_keys_issued_between_listings(self):
+        def issue(wait):
+            baker.make(
+                OutlineUser,
+                user=baker.make(Vpnuser),
+                server=self.server,
+                outline_key_id=2)
+            self.outline.add_key(12)
+
+        with mock.patch('distribution.reconciliation.time.sleep', side_effect=issue):
+            report, = find_orphans([self.server], wait=30)
+        self.assertEqual(report.orphans, [5, 6, 7, 8, 9, 11])
+
+    def test_server_without_known_keys(self):
+        server = baker.make(OutlineServer, api_url=self.outline.api_url, api_cert='other')
+        report, = find_orphans([server])
+        self.assertEqual(report.orphans, [])
+
+    def test_dry_run(self):
+        call_command('reconcile_keys', str(self.server.id), '--dry-run', stdout=mock.Mock())
+        self.assertEqual(KeyRevocation.objects.count(), 2)
+
+    @mock.patch('distribution.reconciliation.process_revocations', return_value=(0, 0))
+    def test_revoke_orphans(self, process):
+        revoke_orphans(find_orphans([self.server]))
+        process.assert_called_once()
+
+        revocations = claim_revocations(50)
+        self.assertEqual(
+            sorted(revocation.outline_key_id for revocation in revocations),
+            [2, 4, 5, 6, 7, 8, 9, 11])
+        self.assertEqual(
+            [revocation.outline_user.outline_key_id
+             for revocation in revocations if revocation.outline_user],
+            [5])
+        for revocation in revocations:
+            self.assertTrue(process_revocation(revocation))
+        self.assertEqual(sorted(self.outline.keys), ['0', '1', '10', '3'])
+
+
+@override_settings(ROOT_URLCONF='distribution.urls')
+@mock.patch('distribution.views.transaction.on_commit', lambda func: func())
+@mock.patch('distribution.serializers.get_client')
+class IdempotencyTest(TestCase):
+    """
+    Tests for replaying key issuance with an Idempotency-Key
+    """
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.client.force_authenticate(baker.make(User))
+        baker.make(
+            OutlineServer,
+            active=True,
+            is_distributing=True,
+            level=0,
+            user_src='TG',
+            _quantity=3)
+        baker.make(Vpnuser, username='alice', channel='TG')
+
+    def issue(self, idempotency_key=None):
+        headers = {}
+        if idempotency_key:
+            headers['HTTP_IDEMPOTENCY_KEY'] = idempotency_key
+        return self.client.post(
+            '/distribution/listoutlineusers?format=json',
+            {'user': 'alice'},
+            format='json',
+            **headers)
+
+    def test_duplicate_is_replayed(self, client):
+        client.return_value = fake_client()
+        first = self.issue('retry-1')
+        second = self.issue('retry-1')
+
+        self.assertEqual(first.status_code, 201)
+        self.assertEqual(second.status_code, 201)
+        self.assertEqual(first.json(), second.json())
+        self.assertEqual(second['Idempotent-Replayed'], 'true')
+        self.assertEqual(client.return_value.new.call_count, 1)
+        self.assertEqual(OutlineUser.objects.count(), 1)
+
+    def test_other_keys_issue_again(self, client):
+        client.return_value = fake_client()
+        self.issue('retry-1')
+        self.issue('retry-2')
+        self.issue()
+        self.assertEqual(OutlineUser.objects.count(), 3)
+
+    def test_failure_is_not_stored(self, client):
+        client.return_value.new.return_value = {}
+        self.assertEqual(self.issue('retry-1').status_code, 406)
+        client.return_value = fake_client()
+        self.assertEqual(self.issue('retry-1').status_code, 201)
+
+    def test_body_must_be_an_object(self, client):
+        response = self.client.post(
+            '/distribution/listoutlineusers?format=json',
+            ['alice'],
+            format='json',
+            HTTP_IDEMPOTENCY_KEY='retry-1')
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(client.called)
+
+
+@override_settings(ROOT_URLCONF='distribution.urls')
+class AsyncIssueTest(TestCase):
+    """
+    Tests for the async key issuance endpoint
+    """
+
+    def setUp(self):
+        cache.clear()
+        self.outline = FakeOutlineServer()
+        self.outline.__enter__()
+        self.addCleanup(self.outline.__exit__)
+        self.server = baker.make(
+            OutlineServer,
+            api_url=self.outline.api_url,
+            active=True,
+            is_distributing=True,
+            level=0,
+            user_src='TG')
+        self.user = baker.make(Vpnuser, username='alice', channel='TG')
+        self.old_key = baker.make(
+            OutlineUser, user=self.user, server=baker.make(OutlineServer))
+        self.client = APIClient()
+        self.client.force_authenticate(baker.make(User))
+
+    def post(self, data):
+        return self.client.post(
+            '/distribution/listoutlineusers/async', data, format='json')
+
+    def test_issue_key(self):
+        response = self.post({'user': 'alice'})
+
+        self.assertEqual(response.status_code, 201)
+        data = response.json()
+        self.assertEqual(data['user'], 'alice')
+        self.assertEqual(data['server'], self.server.id)
+        self.assertEqual(list(self.outline.keys), [str(data['outline_key_id'])])
+        self.assertEqual(
+            self.outline.requests, [('POST', '/secret/access-keys', {})])
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.current_key.outline_key, data['outline_key'])
+        self.assertEqual(KeyRevocation.objects.get().outline_user, self.old_key)
+
+    def test_unauthenticated(self):
+        self.client.force_authenticate(None)
+        self.assertEqual(self.post({'user': 'alice'}).status_code, 401)
+        self.assertEqual(self.outline.requests, [])
+
+    def test_invalid_request(self):
+        self.assertEqual(self.post({}).status_code, 400)
+        self.assertEqual(
+            self.client.get('/distribution/listoutlineusers/async').status_code, 405)
+
+    def test_server_error(self):
+        self.outline.prefix = '/other'
+        self.assertEqual(self.post({'user': 'alice'}).status_code, 406)
+        self.assertFalse(OutlineUser.objects.filter(server=self.server).exists())
+
+    def test_unknown_user(self):
+        self.assertEqual(self.post({'user': 'bob'}).status_code, 406)
+
+    def test_key_is_pooled_if_not_saved(self):
+        get_candidates = OutlineuserSerializer.get_candidates
+
+        def delete_user_meanwhile(serializer, user):
+            servers = get_candidates(serializer, user)
+            Vpnuser.objects.filter(id=user.id).delete()
+            return servers
+
+        with mock.patch.object(
+                OutlineuserSerializer, 'get_candidates', delete_user_meanwhile):
+            self.assertEqual(self.post({'user': 'alice'}).status_code, 406)
+        pooled_key = PooledKey.objects.get()
+        self.assertEqual(pooled_key.server, self.server)
+        self.assertEqual([str(pooled_key.outline_key_id)], list(self.outline.keys))
+
+
+@override_settings(ROOT_URLCONF='distribution.urls')
+@mock.patch('distribution.cache.transaction.on_commit', lambda func: func())
+class ConditionalGetTest(TestCase):
+    """
+    Tests for answering unchanged resources with 304
+    """
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.client.force_authenticate(baker.make(User))
+        self.user = baker.make(Vpnuser, username='alice')
+        self.server = baker.make(OutlineServer)
+        baker.make(OutlineUser, user=self.user, server=self.server)
+
+    def get(self, url, etag=None):
+        headers = {'HTTP_IF_NONE_MATCH': etag} if etag else {}
+        return self.client.get(url, {'format': 'json'}, **headers)
+
+    def test_user_not_modified(self):
+        response = self.get('/distribution/user/alice')
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('Last-Modified', response)
+
+        with self.assertNumQueries(0):
+            response = self.get('/distribution/user/alice', response['ETag'])
+        self.assertEqual(response.status_code, 304)
+
+    def test_not_modified_on_miss(self):
+        etag = self.get('/distribution/user/alice')['ETag']
+        cache.clear()
+
+        # Only the validators are read, the user is not serialized
+        with self.assertNumQueries(1):
+            response = self.get('/distribution/user/alice', etag)
+        self.assertEqual(response.status_code, 304)
+
+    def test_user_modified(self):
+        etag = self.get('/distribution/user/alice')['ETag']
+        self.user.reputation = 7
+        self.user.save()
+
+        response = self.get('/distribution/user/alice', etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+        # The cached copy is not served for the new version
+        self.assertEqual(response.json()['reputation'], 7)
+
+    def test_new_key_modifies_outline_user(self):
+        etag = self.get('/distribution/outline/alice')['ETag']
+        self.assertEqual(self.get('/distribution/outline/alice', etag).status_code, 304)
+
+        key = baker.make(OutlineUser, user=self.user, server=self.server)
+        response = self.get('/distribution/outline/alice', etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['outline_key'], key.outline_key)
+
+    def test_missing_user(self):
+        self.assertEqual(self.get('/distribution/user/bob').status_code, 404)
+
+    def test_issues(self):
+        baker.make(Issue, _quantity=3)
+        etag = self.get('/distribution/issues')['ETag']
+        with self.assertNumQueries(1):
+            response = self.get('/distribution/issues', etag)
+        self.assertEqual(response.status_code, 304)
+
+        Issue.objects.first().delete()
+        response = self.get('/distribution/issues', etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.json()['results']), 2)
+
+    def test_issue_pages(self):
+        baker.make(Issue, _quantity=3)
+        first = self.client.get(
+            '/distribution/issues', {'format': 'json', 'page_size': 2})
+        cursor = first.json()['next'].split('cursor=')[1].split('&')[0]
+
+        response = self.client.get(
+            '/distribution/issues',
+            {'format': 'json', 'page_size': 2, 'cursor': cursor},
+            HTTP_IF_NONE_MATCH=first['ETag'])
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.json()['results']), 1)
@@ -0,0 +1,106 @@
+# Copyright 2020 ASL19 Organization
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from django.conf import settings
+from django.utils import timezone
+
+from distribution.cache import invalidate_users
+from distribution.models import Vpnuser, OutlineUser
+from server.upstream import observe_upstream
+
+logger = logging.getLogger(__name__)
+
+PROMETHEUS_QUERY_URL = 'http://{}:{}/api/v1/query'
+TRANSFER_QUERY = 'sum by (access_key) (increase(shadowsocks_data_bytes{{dir=~"c<p|p>t"}}[{}]))'
+
+
+def get_server_transfers(server, duration='30d'):
+    """
+    Return the data transfer of every key of the server during the
+    latest duration as a dictionary of key id to bytes, using a single
+    Prometheus query. Returns None in case of any error.
+    """
+    url = PROMETHEUS_QUERY_URL.format(server.ipv4, server.prometheus_port)
+    try:
+        with observe_upstream('prometheus', 'server_transfers'):
+            req = requests.get(
+                url,
+                params={'query': TRANSFER_QUERY.format(duration)},
+                timeout=getattr(settings, 'PROMETHEUS_TIMEOUT', 30))
+        req.raise_for_status()
+        results = req.json()['data']['result']
+    except Exception as exc:
+        logger.error('Error in getting data transfer of server {} ({})'.format(
+            server.id, str(exc)))
+        return None
+
+    transfers = {}
+    for result in results:
+        try:
+            transfers[int(result['metric']['access_key'])] = float(result['value'][1])
+        except (KeyError, ValueError, IndexError):
+            continue
+    return transfers
+
+
+def update_server_transfers(server, transfers):
+    """
+    Save the transfers of the server's current keys. Replaced keys keep
+    the final transfer recorded when they were revoked.
+    Returns the number of updated keys.
+    """
+    now = timezone.now()
+    outline_users = []
+    current_keys = Vpnuser.objects.filter(
+        current_key__server=server).values('current_key')
+    for outline_user in OutlineUser.objects.filter(
+            server=server,
+            id__in=current_keys).only(
+                'id', 'outline_key_id', 'transfer', 'updated_date'):
+        transfer = transfers.get(outline_user.outline_key_id, 0.0)
+        if outline_user.transfer != transfer:
+            outline_user.transfer = transfer
+            outline_user.updated_date = now
+            outline_users.append(outline_user)
+    OutlineUser.objects.bulk_update(
+        outline_users, ['transfer', 'updated_date'], batch_size=500)
+    for start in range(0, len(outline_users), 500):
+        invalidate_users(Vpnuser.objects.filter(current_key__in=[
+            outline_user.id for outline_user in outline_users[start:start + 500]
+        ]).values_list('username', flat=True))
+    return len(outline_users)
+
+
+def collect_transfers(servers, duration='30d', workers=8):
+    """
+    Query Prometheus of all servers in parallel and save the transfer
+    of their current keys. Returns the number of updated keys and the
+    list of servers that could not be queried.
+    """
+    servers = list(servers)
+    updated = 0
+    failed = []
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        results = executor.map(
+            lambda server: get_server_transfers(server, duration), servers)
+        for server, transfers in zip(servers, results):
+            if transfers is None:
+                failed.append(server)
+                continue
+            updated += update_server_transfers(server, transfers)
+    return updated, failed
@@ -14,6 +14,7 @@
 
 from django.urls import path, include, re_path
 from distribution import views
+from distribution.metrics import metrics_view
 
 
 urlpatterns = [
@@ -22,8 +23,14 @@ urlpatterns = [
     path('outline', views.OutlineUserView.as_view()),
     re_path(r'outline/(?P<user>\w+)$', views.OutlineUserView.as_view()),
     path('users', views.VpnuserList.as_view()),
+    path('users/batch', views.VpnuserBatchView.as_view()),
     path('listoutlineusers', views.OutlineUserList.as_view()),
+    path('listoutlineusers/batch', views.OutlineUserBatchView.as_view()),
+    path('listoutlineusers/async', views.outline_user_create_async),
     path('issues', views.IssueList.as_view()),
 ]
 
-urlpatterns = [path('distribution/', include(urlpatterns))]
+urlpatterns = [
+    path('distribution/', include(urlpatterns)),
+    path('metrics', metrics_view),
+]
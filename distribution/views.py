@@ -14,28 +14,43 @@
 
 from datetime import datetime, timedelta
 
-from django.http import Http404
+from asgiref.sync import sync_to_async
 from django.conf import settings
+from django.db import transaction
+from django.http import HttpResponseNotAllowed, JsonResponse
 from django.shortcuts import get_object_or_404
 
-from rest_framework import permissions, generics
+from rest_framework import permissions, generics, status
+from rest_framework.exceptions import (
+    APIException, NotAuthenticated, ValidationError)
+from rest_framework.request import Request
+from rest_framework.response import Response
 from rest_framework.settings import api_settings
 from rest_framework_csv.renderers import CSVRenderer
 
+from distribution.cache import get_idempotent_result, set_idempotent_result
+from distribution.conditional import (
+    ConditionalRetrieveMixin, queryset_validators)
+from distribution.export import StreamingExportMixin
+from distribution.issuance import issue_keys
 from distribution.models import Vpnuser, OutlineUser, Issue
+from distribution.pagination import KeysetPagination, UpdatedSinceFilter
 from distribution.serializers import (
     VpnuserSerializer,
+    VpnuserBatchSerializer,
     OutlineuserSerializer,
     IssueSerializer)
 
 
-class VpnuserView(generics.RetrieveUpdateDestroyAPIView):
+class VpnuserView(ConditionalRetrieveMixin,
+                  generics.RetrieveUpdateDestroyAPIView):
     """
     View to CRUD VPN user
     """
     queryset = Vpnuser.objects.all()
     serializer_class = VpnuserSerializer
     permission_classes = [permissions.IsAuthenticated]
+    cache_kind = 'user'
 
     def get_object(self):
         """
@@ -47,8 +62,8 @@ class VpnuserView(generics.RetrieveUpdateDestroyAPIView):
             username = self.kwargs.get('username', None)
         else:
             username = self.request.data.get('username', None)
-        return get_object_or_404(Vpnuser, username=username)
-
+        return get_object_or_404(
+            Vpnuser.objects.with_outline_key(), username=username)
     def perform_destroy(self, instance):
         """
         Override perform_destroy to mark the user to be deleted
@@ -61,7 +76,61 @@ class VpnuserView(generics.RetrieveUpdateDestroyAPIView):
             days = 7
         instance.banned = True
         instance.delete_date = datetime.now() + timedelta(days=days)
-        instance.save()
+        instance.save(update_fields=['banned', 'delete_date', 'updated_date'])
+
+
+class VpnuserBatchView(generics.GenericAPIView):
+    """
+    View to register a list of VPN users in one call
+    """
+    serializer_class = VpnuserBatchSerializer
+    permission_classes = [permissions.IsAuthenticated]
+
+    def post(self, request, *args, **kwargs):
+        """
+        Validate all users, check their usernames with one query and
+        insert the new ones in bulk. Returns the result of each item
+        in the order they were sent.
+        """
+        if not isinstance(request.data, list):
+            raise ValidationError('Expected a list of users.')
+        max_size = getattr(settings, 'USER_BATCH_MAX_SIZE', 500)
+        if len(request.data) > max_size:
+            raise ValidationError(
+                'A batch can have at most {} users.'.format(max_size))
+
+        results = []
+        new_users = {}
+        for item in request.data:
+            serializer = self.get_serializer(data=item)
+            if not serializer.is_valid():
+                results.append({
+                    'username': item.get('username') if isinstance(item, dict) else None,
+                    'status': 'invalid',
+                    'errors': serializer.errors})
+                continue
+            username = serializer.validated_data['username']
+            results.append({'username': username, 'status': 'created'})
+            new_users.setdefault(username, serializer.validated_data)
+
+        existing = set(Vpnuser.objects.filter(
+            username__in=new_users).order_by().values_list('username', flat=True))
+        Vpnuser.objects.bulk_create(
+            [Vpnuser(**data) for username, data in new_users.items()
+             if username not in existing],
+            ignore_conflicts=True)
+
+        ids = dict(Vpnuser.objects.filter(
+            username__in=new_users).order_by().values_list('username', 'id'))
+        created = set()
+        for result in results:
+            if result['status'] == 'invalid':
+                continue
+            if result['username'] in existing or result['username'] in created:
+                result['status'] = 'exists'
+            created.add(result['username'])
+            result['id'] = ids.get(result['username'])
+        return Response(results, status=status.HTTP_200_OK)
 
 
 class VpnuserCSVRenderer(CSVRenderer):
@@ -84,7 +153,7 @@ class VpnuserCSVRenderer(CSVRenderer):
             .render(data, media_type, renderer_context)
 
 
-class VpnuserList(generics.ListAPIView):
+class VpnuserList(StreamingExportMixin, generics.ListAPIView):
     """
     List of all VPN users in both CSV and JSON
     """
@@ -92,26 +161,39 @@ class VpnuserList(generics.ListAPIView):
     permission_classes = [permissions.IsAuthenticated]
     renderer_classes = (VpnuserCSVRenderer, ) + \
         tuple(api_settings.DEFAULT_RENDERER_CLASSES)
+    pagination_class = KeysetPagination
+    filter_backends = [UpdatedSinceFilter]
+    export_filename = 'users'
+    export_fields = (
+        ('username', 'username'),
+        ('channel', 'channel'),
+        ('reputation', 'reputation'),
+        ('delete_date', 'delete_date'),
+        ('banned', 'banned'),
+        ('outline_key', 'current_key__outline_key'))
 
     def get_queryset(self):
         """
         Optionally restricts the returned users list,
         by filtering against a `banned` query parameter in the URL.
         """
-        queryset = Vpnuser.objects.all()
+        queryset = Vpnuser.objects.with_outline_key()
         banned = self.request.query_params.get('banned', None)
         if banned in ['True', 'False']:
             queryset = queryset.filter(banned=banned)
         return queryset
 
 
-class OutlineUserView(generics.RetrieveUpdateAPIView):
+class OutlineUserView(ConditionalRetrieveMixin,
+                      generics.RetrieveUpdateAPIView):
     """
     View to Retrieve and Create Outline users
     """
     queryset = OutlineUser.objects.all()
     serializer_class = OutlineuserSerializer
     permission_classes = [permissions.IsAuthenticated]
+    cache_kind = 'outline'
+    username_kwarg = 'user'
 
     def get_object(self):
         """
@@ -121,12 +203,9 @@ class OutlineUserView(generics.RetrieveUpdateAPIView):
             return None
         elif self.request.method == 'GET':
             user = self.kwargs.get('user', None)
-        try:
-            ouser = OutlineUser.objects.filter(user__username=user).last()
-        except OutlineUser.DoesNotExist:
-            raise Http404
-        return ouser
-
+        vpnuser = Vpnuser.objects.with_outline_key().filter(
+            username=user).first()
+        return vpnuser.current_key if vpnuser else None
 
 class OutlineuserCSVRenderer(CSVRenderer):
     results_field = 'results'
@@ -138,7 +217,7 @@ class OutlineuserCSVRenderer(CSVRenderer):
         return super(OutlineuserCSVRenderer, self).render(data, media_type, renderer_context)
 
 
-class OutlineUserList(generics.ListCreateAPIView):
+class OutlineUserList(StreamingExportMixin, generics.ListCreateAPIView):
     """
     List of all Outline users in both CSV and JSON
     """
@@ -148,6 +227,16 @@ class OutlineUserList(generics.ListCreateAPIView):
     permission_classes = [permissions.IsAuthenticated]
     renderer_classes = (OutlineuserCSVRenderer, ) + \
         tuple(api_settings.DEFAULT_RENDERER_CLASSES)
+    pagination_class = KeysetPagination
+    filter_backends = [UpdatedSinceFilter]
+    export_filename = 'outlineusers'
+    export_fields = (
+        ('user', 'user__username'),
+        ('server', 'server_id'),
+        ('outline_key', 'outline_key'),
+        ('reputation', 'reputation'),
+        ('transfer', 'transfer'),
+        ('user_issue', 'user_issue_id'))
 
     def get_queryset(self):
         """
@@ -157,7 +246,8 @@ class OutlineUserList(generics.ListCreateAPIView):
 
         if user_issue is None then user hasn't reported the server blocked
         """
-        queryset = OutlineUser.objects.exclude(user__isnull=True)
+        queryset = OutlineUser.objects.exclude(
+            user__isnull=True).select_related('user')
         blocked = self.request.query_params.get('blocked', None)
         if blocked is not None:
             if blocked.lower() == 'true':
@@ -169,8 +259,145 @@ class OutlineUserList(generics.ListCreateAPIView):
             queryset = queryset.filter(user_issue__isnull=not blocked)
         return queryset
 
+    def create(self, request, *args, **kwargs):
+        """
+        Issue a new key. Requests with an Idempotency-Key header are
+        served once per user and key; retries replay the stored result.
+        """
+        idempotency_key = request.headers.get('Idempotency-Key')
+        if not idempotency_key:
+            return super(OutlineUserList, self).create(request, *args, **kwargs)
+
+        if not isinstance(request.data, dict):
+            raise ValidationError({
+                api_settings.NON_FIELD_ERRORS_KEY:
+                    ['Invalid data. Expected a dictionary.']})
+        username = str(request.data.get('user', ''))
+        data = get_idempotent_result(username, idempotency_key)
+        if data is None:
+            with transaction.atomic():
+                # Wait for a concurrent request with the same key to finish
+                list(Vpnuser.objects.select_for_update().filter(
+                    username=username).values_list('id', flat=True))
+                data = get_idempotent_result(username, idempotency_key)
+                if data is None:
+                    response = super(OutlineUserList, self).create(
+                        request, *args, **kwargs)
+                    result = dict(response.data)
+                    # Only replay keys that were committed
+                    transaction.on_commit(lambda: set_idempotent_result(
+                        username, idempotency_key, result))
+                    return response
+
+        response = Response(data, status=status.HTTP_201_CREATED)
+        response['Idempotent-Replayed'] = 'true'
+        return response
+
+
+class OutlineUserBatchView(generics.GenericAPIView):
+    """
+    View to issue new keys for a list of users in one call
+    """
+    serializer_class = OutlineuserSerializer
+    permission_classes = [permissions.IsAuthenticated]
+
+    def post(self, request, *args, **kwargs):
+        """
+        Fetch all users at once, allocate their servers in one pass and
+        create the keys concurrently per server. Returns the result of
+        each username in the order they were sent.
+        """
+        usernames = request.data.get('users', None) \
+            if isinstance(request.data, dict) else None
+        if not isinstance(usernames, list) or \
+                not all(isinstance(username, str) for username in usernames):
+            raise ValidationError({'users': 'Expected a list of usernames.'})
+        max_size = getattr(settings, 'KEY_BATCH_MAX_SIZE', 200)
+        if len(usernames) > max_size:
+            raise ValidationError(
+                {'users': 'A batch can have at most {} users.'.format(max_size)})
+
+        users = {
+            user.username: user
+            for user in Vpnuser.objects.filter(username__in=usernames)}
+        eligible = [
+            user for username, user in users.items() if not user.banned]
+        outline_users, _ = issue_keys(eligible)
+        issued = {outline_user.user_id: outline_user for outline_user in outline_users}
+
+        results = []
+        for username in usernames:
+            user = users.get(username)
+            if user is None:
+                results.append({'user': username, 'status': 'not_found'})
+            elif user.banned:
+                results.append({'user': username, 'status': 'banned'})
+            elif user.id not in issued:
+                results.append({'user': username, 'status': 'failed'})
+            else:
+                result = self.get_serializer(issued[user.id]).data
+                result['status'] = 'issued'
+                results.append(result)
+        return Response(results, status=status.HTTP_200_OK)
+
+
+def _authenticate(request):
+    """
+    Authenticate the request with the API's authentication classes
+    and return its parsed data
+    """
+    request = Request(
+        request,
+        parsers=[parser() for parser in api_settings.DEFAULT_PARSER_CLASSES],
+        authenticators=[
+            auth() for auth in api_settings.DEFAULT_AUTHENTICATION_CLASSES])
+    if not (request.user and request.user.is_authenticated):
+        raise NotAuthenticated()
+    return request.data
+
+
+async def outline_user_create_async(request):
+    """
+    Async variant of creating an Outline user on OutlineUserList.
+    The Outline API is awaited, so one worker can serve many issuances
+    at the same time when running under ASGI.
+    """
+    if request.method != 'POST':
+        return HttpResponseNotAllowed(['POST'])
+    try:
+        data = await sync_to_async(_authenticate, thread_sensitive=True)(request)
+        serializer = OutlineuserSerializer(data=data)
+        serializer.is_valid(raise_exception=True)
+        outline_user = await serializer.create_async(serializer.validated_data)
+    except APIException as exc:
+        detail = exc.detail if isinstance(exc.detail, (list, dict)) \
+            else {'detail': exc.detail}
+        return JsonResponse(detail, status=exc.status_code, safe=False)
+
+    data = await sync_to_async(
+        lambda: OutlineuserSerializer(outline_user).data, thread_sensitive=True)()
+    return JsonResponse(data, status=status.HTTP_201_CREATED)
+
+
+# Authentication and CSRF checks are done by the authentication classes
+outline_user_create_async.csrf_exempt = True
+
 
 class IssueList(generics.ListAPIView):
     queryset = Issue.objects.all()
     serializer_class = IssueSerializer
     permission_classes = [permissions.IsAuthenticated]
+    pagination_class = KeysetPagination
+    filter_backends = [UpdatedSinceFilter]
+
+    def list(self, request, *args, **kwargs):
+        """
+        Answer with 304 if no issue changed since the client's copy
+        """
+        validators = queryset_validators(
+            self.filter_queryset(self.get_queryset()), request)
+        not_modified = validators.not_modified(request)
+        if not_modified is not None:
+            return not_modified
+        return validators.apply(
+            super(IssueList, self).list(request, *args, **kwargs))
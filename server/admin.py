@@ -12,17 +12,89 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-from django.contrib import admin
+import logging
+import threading
+
+from django.contrib import admin, messages
+from django.db import connection
+
+from distribution.evacuation import (
+    evacuate_server, lock_evacuation, unlock_evacuation)
+from server.health import HEALTH_FIELDS
 from .models import OutlineServer
 
+logger = logging.getLogger(__name__)
+
+
+def _evacuate(servers):
+    """
+    Evacuate the servers, whose evacuation locks are already taken
+    """
+    try:
+        for server in servers:
+            try:
+                moved, failed = evacuate_server(server)
+                logger.info('Evacuated server {}: {} users moved, {} failed'.format(
+                    server.id, moved, failed))
+            except Exception as exc:
+                logger.error(exc)
+            finally:
+                unlock_evacuation(server.id)
+    finally:
+        connection.close()
+
 
 @admin.register(OutlineServer)
 class OutlineServerAdmin(admin.ModelAdmin):
     list_display = ('id', 'name', 'ipv4', 'user_src',
-                    'level', 'active')
+                    'level', 'active', 'alert', 'is_healthy', 'api_latency',
+                    'user_count', 'capacity')
     list_display_links = ('id', 'name')
-    list_filter = ['user_src', 'level', 'active']
+    list_filter = ['user_src', 'level', 'active', 'alert', 'is_healthy']
     empty_value_display = 'unknown'
     list_per_page = 10
     list_max_show_all = 100
     search_fields = ['name', 'ipv4']
+    # Maintained by update_user_counts and check_servers
+    readonly_fields = ['user_count'] + HEALTH_FIELDS
+    actions = ['evacuate']
+
+    def save_model(self, request, obj, form, change):
+        """
+        Only write the fields changed in the form, so saving a server
+        does not overwrite what was updated since the form was loaded
+        """
+        if not change:
+            return super(OutlineServerAdmin, self).save_model(
+                request, obj, form, change)
+        concrete = {field.name for field in obj._meta.concrete_fields}
+        update_fields = [name for name in form.changed_data if name in concrete]
+        if update_fields:
+            obj.save(update_fields=update_fields)
+
+    def evacuate(self, request, queryset):
+        """
+        Move users of the selected servers to other servers
+        in the background
+        """
+        servers = []
+        running = []
+        for server in queryset:
+            if lock_evacuation(server.id):
+                servers.append(server)
+            else:
+                running.append(server)
+        if running:
+            self.message_user(
+                request,
+                'Servers {} are already being evacuated.'.format(
+                    ', '.join(str(server.id) for server in running)),
+                messages.WARNING)
+        if not servers:
+            return
+        threading.Thread(target=_evacuate, args=(servers, ), daemon=True).start()
+        self.message_user(
+            request,
+            'Evacuation of {} servers started. Run it again to resume '
+            'if it is interrupted.'.format(len(servers)))
+    evacuate.short_description = 'Evacuate selected servers'
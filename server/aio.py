@@ -0,0 +1,95 @@
+# Copyright 2020 ASL19 Organization
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import logging
+
+import httpx
+from django.conf import settings
+from outline_api.outline_api import ACCESS_URL, KEY_URL
+
+from server.upstream import observe_upstream
+
+logger = logging.getLogger(__name__)
+
+
+def new_session(pool_size=None):
+    """
+    Return a new httpx session keeping at most pool_size connections.
+    Certificates are not verified, as Outline servers are self-signed.
+    The caller owns the session and has to close it.
+    """
+    if pool_size is None:
+        pool_size = getattr(settings, 'OUTLINE_CLIENT_POOL_SIZE', 10)
+    return httpx.AsyncClient(
+        verify=False,
+        limits=httpx.Limits(
+            max_connections=pool_size,
+            max_keepalive_connections=pool_size))
+
+
+class AsyncOutlineClient(object):
+    """
+    Outline manager for async code, with the same results
+    as server.clients.OutlineClient.
+    Use it as an async context manager, which closes its session
+    unless one was given.
+    """
+
+    def __init__(self, apiurl, timeout=3, session=None):
+        self.apiurl = apiurl
+        self.timeout = timeout
+        self.owns_session = session is None
+        self.session = new_session() if session is None else session
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+    async def close(self):
+        if self.owns_session:
+            await self.session.aclose()
+
+    async def new(self):
+        """
+        Create a new access key and return it, or an empty dict on error
+        """
+        try:
+            with observe_upstream('outline', 'new'):
+                response = await self.session.post(
+                    ACCESS_URL.format(self.apiurl), timeout=self.timeout)
+            if response.status_code != httpx.codes.CREATED:
+                return {}
+            return response.json()
+        except Exception as err:
+            logger.error(
+                'An error occurred during creating a new access key: %s',
+                str(err) or type(err).__name__)
+            return {}
+
+    async def delete(self, id):
+        """
+        Delete an access key and return True on success
+        """
+        try:
+            with observe_upstream('outline', 'delete'):
+                response = await self.session.delete(
+                    KEY_URL.format(self.apiurl, id), timeout=self.timeout)
+            return response.status_code == httpx.codes.NO_CONTENT
+        except Exception as err:
+            logger.error(
+                'An error occurred during deleting the access key: %s',
+                str(err) or type(err).__name__)
+            return False
@@ -0,0 +1,171 @@
+# Copyright 2020 ASL19 Organization
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import random
+from collections import defaultdict
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import F
+
+from server.breaker import open_breakers
+from server.models import OutlineServer
+
+ALLOCATION_CACHE_KEY = 'server:allocation_index'
+USER_COUNT_CACHE_KEY = 'server:user_count:{}'
+
+
+def build_allocation_index():
+    """
+    Load every healthy distributing server in a single query and group
+    them by (level, user_src)
+    """
+    index = {}
+    servers = OutlineServer.objects.active().distributing().healthy().order_by('id')
+    for server in servers:
+        index.setdefault((server.level, server.user_src), []).append(server)
+    return index
+
+
+def get_allocation_index():
+    """
+    Return the cached allocation index, rebuilding it on a miss
+    """
+    index = cache.get(ALLOCATION_CACHE_KEY)
+    if index is None:
+        index = build_allocation_index()
+        timeout = getattr(settings, 'SERVER_ALLOCATION_CACHE_TIMEOUT', 300)
+        cache.set(ALLOCATION_CACHE_KEY, index, timeout)
+        cache_user_counts({
+            server.id: (server.user_count, server.capacity)
+            for servers in index.values() for server in servers})
+    return index
+
+
+def invalidate_allocation_index():
+    """
+    Drop the cached allocation index so the next lookup reloads it
+    """
+    cache.delete(ALLOCATION_CACHE_KEY)
+
+
+def eligible_servers(level, channel, exclude=None):
+    """
+    List servers that can distribute keys for the given level and channel,
+    leaving out the server ids in exclude
+    """
+    exclude = set(exclude or ())
+    servers = get_allocation_index().get((level, channel), [])
+    return [server for server in servers if server.id not in exclude]
+
+
+def cache_user_counts(counts):
+    """
+    Cache the number of users and capacity of the servers, given as a
+    dictionary of server id to (user_count, capacity). Counts are kept
+    apart from the allocation index so they can be refreshed on their own.
+    """
+    cache.set_many(
+        {USER_COUNT_CACHE_KEY.format(server_id): value
+         for server_id, value in counts.items()},
+        getattr(settings, 'SERVER_ALLOCATION_CACHE_TIMEOUT', 300))
+
+
+def server_counts(servers):
+    """
+    Return the cached number of users and capacity of each server,
+    falling back to the values loaded with the allocation index
+    """
+    cached = cache.get_many(
+        [USER_COUNT_CACHE_KEY.format(server.id) for server in servers])
+    return {
+        server.id: cached.get(
+            USER_COUNT_CACHE_KEY.format(server.id),
+            (server.user_count, server.capacity))
+        for server in servers}
+
+
+def server_weight(user_count, capacity):
+    """
+    Number of free slots of a server. Servers without a capacity
+    are weighted as if they had SERVER_DEFAULT_CAPACITY.
+    """
+    if capacity is None:
+        capacity = getattr(settings, 'SERVER_DEFAULT_CAPACITY', 1000)
+    return max(capacity - user_count, 1)
+
+
+def candidate_servers(level, channel, exclude=None, counts=None):
+    """
+    List eligible servers whose breaker is not open, in a random order
+    weighted by their free slots, so that the least loaded servers are
+    tried first and failover spreads over the remaining ones.
+    The cached counts of server_counts are used unless given.
+    """
+    servers = eligible_servers(level, channel, exclude)
+    opened = open_breakers([server.id for server in servers])
+    servers = [server for server in servers if server.id not in opened]
+    if not servers:
+        return servers
+    if counts is None:
+        counts = server_counts(servers)
+    servers.sort(
+        key=lambda server: random.random() ** (
+            1.0 / server_weight(*counts[server.id])),
+        reverse=True)
+    return servers
+
+
+def choose_server(level, channel, exclude=None, counts=None):
+    """
+    Pick a random candidate server, or None if there is none
+    """
+    servers = candidate_servers(level, channel, exclude, counts)
+    if not servers:
+        return None
+    return servers[0]
+
+
+def update_user_counts(deltas):
+    """
+    Apply the changes in the number of users of each server, given as a
+    dictionary of server id to delta, refresh their cached counts once
+    committed, and stop distributing from the servers that reached
+    their capacity
+    """
+    by_delta = defaultdict(list)
+    for server_id, delta in deltas.items():
+        if server_id is not None and delta:
+            by_delta[delta].append(server_id)
+    for delta, server_ids in by_delta.items():
+        OutlineServer.objects.filter(id__in=server_ids).update(
+            user_count=F('user_count') + delta)
+    if not by_delta:
+        return
+
+    counts = {
+        server_id: (user_count, capacity)
+        for server_id, user_count, capacity in OutlineServer.objects.filter(
+            id__in=[server_id for server_ids in by_delta.values()
+                    for server_id in server_ids]
+        ).values_list('id', 'user_count', 'capacity')}
+    transaction.on_commit(lambda: cache_user_counts(counts))
+
+    full = [
+        server_id for server_id, (user_count, capacity) in counts.items()
+        if deltas[server_id] > 0 and capacity is not None and user_count >= capacity]
+    if full and OutlineServer.objects.distributing().filter(
+            id__in=full).update(is_distributing=False):
+        invalidate_allocation_index()
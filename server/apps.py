@@ -17,3 +17,6 @@ from django.apps import AppConfig
 
 class ServerConfig(AppConfig):
     name = 'server'
+
+    def ready(self):
+        import server.signals  # noqa: F401
@@ -0,0 +1,68 @@
+# Copyright 2020 ASL19 Organization
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import logging
+
+from django.conf import settings
+from django.core.cache import cache
+
+logger = logging.getLogger(__name__)
+
+FAILURES_CACHE_KEY = 'server:breaker:failures:{}'
+OPEN_CACHE_KEY = 'server:breaker:open:{}'
+
+
+def open_breakers(server_ids):
+    """
+    Return the ids of the servers whose breaker is open,
+    with a single cache lookup
+    """
+    keys = {OPEN_CACHE_KEY.format(server_id): server_id for server_id in server_ids}
+    if not keys:
+        return set()
+    return {keys[key] for key in cache.get_many(list(keys))}
+
+
+def record_failure(server_id):
+    """
+    Count a failed call to the server and open its breaker for
+    SERVER_BREAKER_COOLDOWN seconds once SERVER_BREAKER_THRESHOLD calls
+    failed within SERVER_BREAKER_WINDOW seconds
+    """
+    window = getattr(settings, 'SERVER_BREAKER_WINDOW', 60)
+    key = FAILURES_CACHE_KEY.format(server_id)
+    cache.add(key, 0, window)
+    try:
+        failures = cache.incr(key)
+    except ValueError:
+        failures = 1
+        cache.set(key, failures, window)
+
+    if failures >= getattr(settings, 'SERVER_BREAKER_THRESHOLD', 3):
+        logger.warning('Opening the breaker of server {} after {} failures'.format(
+            server_id, failures))
+        cache.set(
+            OPEN_CACHE_KEY.format(server_id),
+            True,
+            getattr(settings, 'SERVER_BREAKER_COOLDOWN', 30))
+    return failures
+
+
+def record_success(server_id):
+    """
+    Reset the failure count of the server
+    """
+    cache.delete_many([
+        FAILURES_CACHE_KEY.format(server_id),
+        OPEN_CACHE_KEY.format(server_id)])
@@ -0,0 +1,131 @@
+# Copyright 2020 ASL19 Organization
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import threading
+from collections import OrderedDict
+
+import requests
+from django.conf import settings
+from outline_api import Manager as OutlineManager
+from outline_api.outline_api import ACCESS_URL, KEY_URL
+from requests.adapters import HTTPAdapter
+
+from server.upstream import observe_upstream
+
+_clients = OrderedDict()
+_lock = threading.Lock()
+
+
+class OutlineClient(OutlineManager):
+    """
+    Outline manager that keeps a pooled keep-alive session
+    to the server instead of opening a connection per call
+    """
+
+    def __init__(self, apiurl, apicrt, timeout=3, pool_size=10):
+        super(OutlineClient, self).__init__(apiurl, apicrt)
+        self.timeout = timeout
+        self.session = requests.Session()
+        self.session.headers.update(self.headers)
+        self.session.verify = False
+        adapter = HTTPAdapter(
+            pool_connections=1,
+            pool_maxsize=pool_size,
+            pool_block=True)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+
+    def all(self):
+        """
+        Return the list of all access keys on the server
+        """
+        try:
+            with observe_upstream('outline', 'all'):
+                req = self.session.get(
+                    ACCESS_URL.format(self.apiurl), timeout=self.timeout)
+            return req.json().get('accessKeys', []) if req.ok else []
+        except Exception as err:
+            self._log.error(
+                'An error occurred during getting all access keys: %s',
+                str(err))
+            return []
+
+    def new(self):
+        """
+        Create a new access key and return it, or an empty dict on error
+        """
+        try:
+            with observe_upstream('outline', 'new'):
+                req = self.session.post(
+                    ACCESS_URL.format(self.apiurl), timeout=self.timeout)
+            if req.status_code != requests.codes['created']:
+                return {}
+            return req.json()
+        except Exception as err:
+            self._log.error(
+                'An error occurred during creating a new access key: %s',
+                str(err))
+            return {}
+
+    def delete(self, id):
+        """
+        Delete an access key and return True on success
+        """
+        try:
+            with observe_upstream('outline', 'delete'):
+                req = self.session.delete(
+                    KEY_URL.format(self.apiurl, id), timeout=self.timeout)
+            return req.status_code == requests.codes['no_content']
+        except Exception as err:
+            self._log.error(
+                'An error occurred during deleting the access key: %s',
+                str(err))
+            return False
+
+    def close(self):
+        self.session.close()
+
+
+def get_client(server):
+    """
+    Return the shared client of the server, creating it on first use
+    """
+    key = (server.api_url, server.api_cert)
+    with _lock:
+        client = _clients.get(key)
+        if client is not None:
+            _clients.move_to_end(key)
+            return client
+
+        client = OutlineClient(
+            apiurl=server.api_url,
+            apicrt=server.api_cert,
+            timeout=getattr(settings, 'OUTLINE_CLIENT_TIMEOUT', 3),
+            pool_size=getattr(settings, 'OUTLINE_CLIENT_POOL_SIZE', 10))
+        _clients[key] = client
+        max_clients = getattr(settings, 'OUTLINE_CLIENT_MAX_CLIENTS', 256)
+        while len(_clients) > max_clients:
+            _, stale = _clients.popitem(last=False)
+            stale.close()
+        return client
+
+
+def discard_client(api_url, api_cert):
+    """
+    Close and forget the client for the given url and certificate
+    """
+    with _lock:
+        client = _clients.pop((api_url, api_cert), None)
+    if client is not None:
+        client.close()
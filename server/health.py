@@ -0,0 +1,138 @@
+# Copyright 2020 ASL19 Organization
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import asyncio
+import logging
+import time
+
+import httpx
+from django.conf import settings
+from django.utils import timezone
+
+from server.aio import new_session
+from server.allocation import invalidate_allocation_index
+from server.models import OutlineServer
+
+logger = logging.getLogger(__name__)
+
+PROMETHEUS_PROBE_URL = 'http://{}:{}/api/v1/query?query=up'
+
+HEALTH_FIELDS = [
+    'api_latency',
+    'prometheus_latency',
+    'health_checked',
+    'health_failures',
+    'health_error',
+    'is_healthy']
+
+
+async def probe_url(session, url, timeout):
+    """
+    Send a GET request to the url and return its latency in seconds.
+    Raises an exception if the server does not answer with a
+    successful status within timeout seconds.
+    """
+    start = time.monotonic()
+    response = await asyncio.wait_for(session.get(url), timeout)
+    if not response.is_success:
+        raise ValueError('HTTP {}'.format(response.status_code))
+    return time.monotonic() - start
+
+
+async def _probe(name, session, url, timeout):
+    """
+    Probe the url, returning its latency and error message
+    """
+    if not url:
+        return None, '{}: not configured'.format(name)
+    try:
+        return await probe_url(session, url, timeout), None
+    except (asyncio.TimeoutError, httpx.TimeoutException):
+        return None, '{}: timed out'.format(name)
+    except Exception as exc:
+        return None, '{}: {}'.format(name, str(exc) or type(exc).__name__)
+
+
+async def probe_server(server, timeout, session, semaphore):
+    """
+    Probe the Outline API and Prometheus of the server at the same time
+    """
+    api_url = '{}/server'.format(server.api_url.rstrip('/')) \
+        if server.api_url else None
+    prometheus_url = PROMETHEUS_PROBE_URL.format(
+        server.ipv4, server.prometheus_port) if server.ipv4 else None
+    async with semaphore:
+        return await asyncio.gather(
+            _probe('api', session, api_url, timeout),
+            _probe('prometheus', session, prometheus_url, timeout))
+
+
+async def probe_servers(servers, timeout, concurrency):
+    """
+    Probe the servers with one session for the whole round,
+    closed once every server answered or timed out
+    """
+    semaphore = asyncio.Semaphore(concurrency)
+    # Each probed server takes up to two connections
+    async with new_session(pool_size=2 * concurrency) as session:
+        return await asyncio.gather(*[
+            probe_server(server, timeout, session, semaphore)
+            for server in servers])
+
+
+def check_servers(servers, timeout=None, concurrency=None):
+    """
+    Probe all servers concurrently and save their latency and status
+    in a single query.
+
+    A server is marked unhealthy once its Outline API failed
+    SERVER_HEALTH_MAX_FAILURES checks in a row, which takes it out of
+    the allocation index, and healthy again by the next successful
+    check. Prometheus failures are recorded but do not affect it.
+    The alert flag is left to admins.
+    Returns the list of unhealthy servers.
+    """
+    servers = list(servers)
+    if timeout is None:
+        timeout = getattr(settings, 'SERVER_HEALTH_TIMEOUT', 2)
+    if concurrency is None:
+        concurrency = getattr(settings, 'SERVER_HEALTH_CONCURRENCY', 200)
+    max_failures = getattr(settings, 'SERVER_HEALTH_MAX_FAILURES', 2)
+
+    results = asyncio.run(probe_servers(servers, timeout, concurrency))
+
+    now = timezone.now()
+    health_changed = False
+    for server, ((api_latency, api_error), (prometheus_latency, prometheus_error)) \
+            in zip(servers, results):
+        errors = [error for error in (api_error, prometheus_error) if error]
+        server.api_latency = api_latency
+        server.prometheus_latency = prometheus_latency
+        server.health_checked = now
+        server.health_error = '; '.join(errors)[:256]
+        if api_error:
+            server.health_failures += 1
+            logger.warning('Server {} failed health check ({})'.format(
+                server.id, server.health_error))
+        else:
+            server.health_failures = 0
+        is_healthy = server.health_failures < max_failures
+        if is_healthy != server.is_healthy:
+            server.is_healthy = is_healthy
+            health_changed = True
+
+    OutlineServer.objects.bulk_update(servers, HEALTH_FIELDS, batch_size=500)
+    if health_changed:
+        invalidate_allocation_index()
+    return [server for server in servers if not server.is_healthy]
@@ -0,0 +1,17 @@
+# Generated by Django 3.1 on 2026-10-17 07:32
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('server', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='outlineserver',
+            index=models.Index(condition=models.Q(('active', True), ('is_distributing', True)), fields=['level', 'user_src'], name='outlineserver_alloc_idx'),
+        ),
+    ]
@@ -0,0 +1,38 @@
+# Generated by Django 3.1 on 2026-10-17 07:44
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('server', '0002_hot_path_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='outlineserver',
+            name='api_latency',
+            field=models.FloatField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='outlineserver',
+            name='health_checked',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='outlineserver',
+            name='health_error',
+            field=models.CharField(blank=True, default='', max_length=256),
+        ),
+        migrations.AddField(
+            model_name='outlineserver',
+            name='health_failures',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='outlineserver',
+            name='prometheus_latency',
+            field=models.FloatField(blank=True, null=True),
+        ),
+    ]
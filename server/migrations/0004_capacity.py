@@ -0,0 +1,18 @@
+# Generated by Django 3.1 on 2026-10-17 07:52
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('server', '0003_health_check'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='outlineserver',
+            name='capacity',
+            field=models.IntegerField(blank=True, help_text='Maximum number of users, leave empty for no limit', null=True),
+        ),
+    ]
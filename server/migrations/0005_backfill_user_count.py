@@ -0,0 +1,30 @@
+# Generated by Django 3.1 on 2026-10-17 09:12
+
+from django.db import migrations
+from django.db.models import Count, IntegerField, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def count_users(apps, schema_editor):
+    """
+    Count the users of every server from their current keys
+    """
+    OutlineServer = apps.get_model('server', 'OutlineServer')
+    Vpnuser = apps.get_model('distribution', 'Vpnuser')
+    user_count = Vpnuser.objects.filter(
+        current_key__server=OuterRef('pk')).order_by().values(
+            'current_key__server').annotate(count=Count('id')).values('count')
+    OutlineServer.objects.update(user_count=Coalesce(
+        Subquery(user_count, output_field=IntegerField()), 0))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('distribution', '0005_current_key'),
+        ('server', '0004_capacity'),
+    ]
+
+    operations = [
+        migrations.RunPython(count_users, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,21 @@
+# Generated by Django 3.1 on 2026-10-17 08:23
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('server', '0005_backfill_user_count'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='outlineserver',
+            name='outlineserver_alloc_idx',
+        ),
+        migrations.AddIndex(
+            model_name='outlineserver',
+            index=models.Index(condition=models.Q(('active', True), ('is_distributing', True)), fields=['id'], name='outlineserver_alloc_idx'),
+        ),
+    ]
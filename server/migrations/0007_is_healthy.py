@@ -0,0 +1,18 @@
+# Generated by Django 3.1 on 2026-10-17 08:24
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('server', '0006_allocation_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='outlineserver',
+            name='is_healthy',
+            field=models.BooleanField(default=True),
+        ),
+    ]
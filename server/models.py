@@ -49,6 +49,9 @@ class ServerQuerySet(models.QuerySet):
     def not_distributing(self):
         return self.filter(is_distributing=False)
 
+    def healthy(self):
+        return self.filter(is_healthy=True)
+
 
 class Server(models.Model):
     """
@@ -98,6 +101,11 @@ class Server(models.Model):
     user_count = models.IntegerField(
         default=0)
 
+    capacity = models.IntegerField(
+        null=True,
+        blank=True,
+        help_text='Maximum number of users, leave empty for no limit')
+
     is_blocked = models.BooleanField(
         default=False)
 
@@ -131,3 +139,28 @@ class OutlineServer(Server):
         blank=True)
     prometheus_port = models.IntegerField(
         default=900)
+    api_latency = models.FloatField(
+        null=True,
+        blank=True)
+    prometheus_latency = models.FloatField(
+        null=True,
+        blank=True)
+    health_checked = models.DateTimeField(
+        null=True,
+        blank=True)
+    health_failures = models.IntegerField(
+        default=0)
+    is_healthy = models.BooleanField(
+        default=True)
+    health_error = models.CharField(
+        max_length=256,
+        blank=True,
+        default='')
+
+    class Meta:
+        indexes = [
+            models.Index(
+                fields=['id'],
+                name='outlineserver_alloc_idx',
+                condition=models.Q(active=True, is_distributing=True)),
+        ]
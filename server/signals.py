@@ -0,0 +1,72 @@
+# Copyright 2020 ASL19 Organization
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from django.db.models import DEFERRED
+from django.db.models.signals import (
+    post_delete, post_init, post_save, pre_save)
+from django.dispatch import receiver
+
+from server.allocation import invalidate_allocation_index
+from server.clients import discard_client
+from server.models import OutlineServer
+
+
+@receiver(post_save, sender=OutlineServer)
+@receiver(post_delete, sender=OutlineServer)
+def outline_server_changed(sender, instance, **kwargs):
+    """
+    Keep the allocation index in sync with the server inventory
+    """
+    invalidate_allocation_index()
+
+
+def api_values(instance):
+    """
+    API url and certificate of the server, DEFERRED for deferred fields
+    """
+    return (
+        instance.__dict__.get('api_url', DEFERRED),
+        instance.__dict__.get('api_cert', DEFERRED))
+
+
+@receiver(post_init, sender=OutlineServer)
+@receiver(post_save, sender=OutlineServer)
+def outline_server_loaded(sender, instance, **kwargs):
+    """
+    Remember the API url and certificate the server was loaded or saved with
+    """
+    instance._loaded_api = api_values(instance)
+
+
+@receiver(pre_save, sender=OutlineServer)
+def outline_server_api_changed(sender, instance, **kwargs):
+    """
+    Drop the client of a server whose API url or certificate changes
+    """
+    if instance.pk is None:
+        return
+    previous = getattr(instance, '_loaded_api', (DEFERRED, DEFERRED))
+    if DEFERRED in previous:
+        # Deferred when loaded, only query if they are saved now
+        if DEFERRED in api_values(instance):
+            return
+        previous = OutlineServer.objects.filter(pk=instance.pk).values_list(
+            'api_url', 'api_cert').first()
+    if previous and previous != api_values(instance):
+        discard_client(*previous)
+
+
+@receiver(post_delete, sender=OutlineServer)
+def outline_server_deleted(sender, instance, **kwargs):
+    discard_client(instance.api_url, instance.api_cert)
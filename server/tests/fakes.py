@@ -0,0 +1,201 @@
+# Copyright 2020 ASL19 Organization
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+
+class _HTTPServer(ThreadingHTTPServer):
+    request_queue_size = 128
+
+
+class FakeHTTPServer(object):
+    """
+    Local HTTP server running in a background thread, for tests
+    and benchmarks that should not reach real Outline servers
+    """
+
+    def __init__(self):
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                fake.dispatch(self, 'GET')
+
+            def do_POST(self):
+                fake.dispatch(self, 'POST')
+
+            def do_DELETE(self):
+                fake.dispatch(self, 'DELETE')
+
+            def log_message(self, *args):
+                pass
+
+        self.lock = threading.Lock()
+        self.requests = []
+        self.httpd = _HTTPServer(('127.0.0.1', 0), Handler)
+        self.host, self.port = self.httpd.server_address
+        self.thread = threading.Thread(
+            target=self.httpd.serve_forever, daemon=True)
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *args):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def dispatch(self, handler, method):
+        url = urlparse(handler.path)
+        with self.lock:
+            self.requests.append((method, url.path, parse_qs(url.query)))
+            status, body = self.handle(method, url.path, parse_qs(url.query))
+        data = json.dumps(body).encode() if body is not None else b''
+        handler.send_response(status)
+        handler.send_header('Content-Type', 'application/json')
+        handler.send_header('Content-Length', str(len(data)))
+        handler.end_headers()
+        handler.wfile.write(data)
+
+    def handle(self, method, path, query):
+        """
+        Return the status and JSON body of the response,
+        subclasses serve their own paths
+        """
+        return 404, None
+
+
+class FakePrometheus(FakeHTTPServer):
+    """
+    Prometheus answering every query with the transfer of its keys
+    """
+
+    def __init__(self, transfers=None):
+        super(FakePrometheus, self).__init__()
+        self.transfers = transfers or {}
+
+    def handle(self, method, path, query):
+        if path != '/api/v1/query':
+            return 404, None
+        result = [{
+            'metric': {'access_key': str(key)},
+            'value': [0, str(value)]} for key, value in self.transfers.items()]
+        return 200, {
+            'status': 'success',
+            'data': {'resultType': 'vector', 'result': result}}
+
+
+class FakeOutlineServer(FakeHTTPServer):
+    """
+    Outline management API serving its keys from memory
+    """
+
+    def __init__(self, prefix='/secret'):
+        super(FakeOutlineServer, self).__init__()
+        self.prefix = prefix
+        self.keys = {}
+        self.next_id = 0
+
+    @property
+    def api_url(self):
+        return 'http://{}:{}{}'.format(self.host, self.port, self.prefix)
+
+    def add_key(self, key_id=None):
+        if key_id is None:
+            self.next_id += 1
+            key_id = self.next_id
+        key = {
+            'id': str(key_id),
+            'name': '',
+            'accessUrl': 'ss://fake@{}:{}/{}'.format(self.host, self.port, key_id)}
+        self.keys[key['id']] = key
+        return key
+
+    def handle(self, method, path, query):
+        if not path.startswith(self.prefix):
+            return 404, None
+        path = path[len(self.prefix):]
+        if method == 'GET' and path == '/server':
+            return 200, {'name': 'fake', 'serverId': 'fake'}
+        if method == 'GET' and path == '/access-keys':
+            return 200, {'accessKeys': list(self.keys.values())}
+        if method == 'POST' and path == '/access-keys':
+            return 201, self.add_key()
+        if method == 'DELETE' and path.startswith('/access-keys/'):
+            if self.keys.pop(path[len('/access-keys/'):], None) is None:
+                return 404, None
+            return 204, None
+        return 404, None
+
+
+class FakeOutlineClient(object):
+    """
+    In-memory stand-in for server.clients.OutlineClient
+    """
+
+    def __init__(self, apiurl, apicrt, timeout=3, pool_size=10):
+        self.apiurl = apiurl
+        self.apicrt = apicrt
+        self.lock = threading.Lock()
+        self.keys = {}
+        self.next_id = 0
+
+    def all(self):
+        with self.lock:
+            return list(self.keys.values())
+
+    def new(self):
+        with self.lock:
+            self.next_id += 1
+            key = {
+                'id': str(self.next_id),
+                'accessUrl': 'ss://fake@{}/{}'.format(self.apiurl, self.next_id)}
+            self.keys[key['id']] = key
+        return key
+
+    def delete(self, id):
+        with self.lock:
+            return self.keys.pop(str(id), None) is not None
+
+    def close(self):
+        pass
+
+
+class FakeAsyncOutlineClient(object):
+    """
+    In-memory stand-in for server.aio.AsyncOutlineClient, sharing
+    the keys of each server between instances
+    """
+    servers = {}
+    lock = threading.Lock()
+
+    def __init__(self, apiurl, timeout=3):
+        with self.lock:
+            self.client = self.servers.setdefault(
+                apiurl, FakeOutlineClient(apiurl, None))
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        pass
+
+    async def new(self):
+        return self.client.new()
+
+    async def delete(self, id):
+        return self.client.delete(id)
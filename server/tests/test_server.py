@@ -0,0 +1,269 @@
+# Copyright 2020 ASL19 Organization
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import asyncio
+from unittest import mock
+
+from django.contrib.admin.sites import AdminSite
+from django.core.cache import cache
+from django.test import TestCase, override_settings
+from model_bakery import baker
+
+from server.admin import OutlineServerAdmin
+from server.aio import AsyncOutlineClient, new_session
+from server.allocation import (
+    candidate_servers, eligible_servers, update_user_counts)
+from server.breaker import open_breakers, record_failure, record_success
+from server.clients import get_client
+from server.tests.fakes import FakeOutlineServer, FakePrometheus
+from server.health import check_servers
+from server.models import OutlineServer
+
+
+class ClientRegistryTest(TestCase):
+    """
+    Tests for the shared Outline clients
+    """
+
+    def test_client_is_reused(self):
+        server = baker.make(OutlineServer, api_url='https://a', api_cert='A')
+        same = baker.make(OutlineServer, api_url='https://a', api_cert='A')
+        self.assertIs(get_client(server), get_client(same))
+
+    def test_client_dropped_when_api_changes(self):
+        server = baker.make(OutlineServer, api_url='https://b', api_cert='B')
+        client = get_client(server)
+        server.api_url = 'https://c'
+        server.save()
+        self.assertIsNot(get_client(server), client)
+        server.api_url = 'https://b'
+        self.assertIsNot(get_client(server), client)
+
+    def test_save_does_not_query_api_fields(self):
+        server = OutlineServer.objects.get(
+            id=baker.make(OutlineServer, api_url='https://d', api_cert='D').id)
+        client = get_client(server)
+        with self.assertNumQueries(1):
+            server.save()
+        self.assertIs(get_client(server), client)
+
+        server = OutlineServer.objects.get(id=server.id)
+        server.api_cert = 'E'
+        with self.assertNumQueries(1):
+            server.save()
+        self.assertIsNot(get_client(server), client)
+
+    def test_deferred_api_fields(self):
+        server = baker.make(OutlineServer, api_url='https://f', api_cert='F')
+        client = get_client(server)
+        deferred = OutlineServer.objects.only('id', 'name').get(id=server.id)
+        deferred.save(update_fields=['name'])
+        self.assertIs(get_client(server), client)
+
+        deferred = OutlineServer.objects.only('id').get(id=server.id)
+        deferred.api_url = 'https://g'
+        deferred.api_cert = 'F'
+        deferred.save()
+        self.assertIsNot(get_client(server), client)
+
+    def test_async_client_closes_its_session(self):
+        async def use_clients(session):
+            async with AsyncOutlineClient('https://a') as client:
+                pass
+            async with AsyncOutlineClient('https://a', session=session):
+                pass
+            return client.session
+
+        async def run():
+            async with new_session() as session:
+                own = await use_clients(session)
+                return own.is_closed, session.is_closed
+
+        self.assertEqual(asyncio.run(run()), (True, False))
+
+
+@override_settings(SERVER_HEALTH_TIMEOUT=1, SERVER_HEALTH_MAX_FAILURES=2)
+class HealthCheckTest(TestCase):
+    """
+    Tests for probing the servers
+    """
+
+    def setUp(self):
+        cache.clear()
+
+    def make_server(self, api_url, prometheus_port):
+        return baker.make(
+            OutlineServer,
+            ipv4='127.0.0.1',
+            api_url=api_url,
+            prometheus_port=prometheus_port,
+            active=True,
+            is_distributing=True,
+            level=0,
+            user_src='TG')
+
+    def test_healthy_server(self):
+        with FakeOutlineServer() as outline, FakePrometheus() as prometheus:
+            server = self.make_server(outline.api_url, prometheus.port)
+            self.assertEqual(check_servers([server]), [])
+
+        server.refresh_from_db()
+        self.assertTrue(server.is_healthy)
+        self.assertIsNotNone(server.api_latency)
+        self.assertIsNotNone(server.prometheus_latency)
+        self.assertIsNotNone(server.health_checked)
+        self.assertEqual(server.health_error, '')
+        self.assertEqual(outline.requests[0][:2], ('GET', '/secret/server'))
+
+    def test_alert_is_left_to_admins(self):
+        with FakeOutlineServer() as outline, FakePrometheus() as prometheus:
+            server = self.make_server(outline.api_url, prometheus.port)
+            OutlineServer.objects.filter(id=server.id).update(alert=True)
+            server.refresh_from_db()
+            check_servers([server])
+
+        server.refresh_from_db()
+        self.assertTrue(server.alert)
+        self.assertTrue(server.is_healthy)
+
+    def test_dead_server_is_unhealthy(self):
+        with FakeOutlineServer() as outline, FakePrometheus() as prometheus:
+            pass
+        server = self.make_server(outline.api_url, prometheus.port)
+        self.assertEqual(eligible_servers(0, 'TG'), [server])
+
+        self.assertEqual(check_servers([server]), [])
+        self.assertEqual(check_servers([server]), [server])
+
+        server.refresh_from_db()
+        self.assertFalse(server.is_healthy)
+        self.assertFalse(server.alert)
+        self.assertEqual(server.health_failures, 2)
+        self.assertIsNone(server.api_latency)
+        self.assertIn('api:', server.health_error)
+        self.assertEqual(eligible_servers(0, 'TG'), [])
+
+        with FakeOutlineServer() as outline:
+            server.api_url = outline.api_url
+            server.save()
+            self.assertEqual(check_servers([server]), [])
+        server.refresh_from_db()
+        self.assertTrue(server.is_healthy)
+        self.assertIn('prometheus:', server.health_error)
+        self.assertEqual(eligible_servers(0, 'TG'), [server])
+
+    def test_many_servers_are_probed_concurrently(self):
+        with FakeOutlineServer() as outline, FakePrometheus() as prometheus:
+            servers = [
+                self.make_server(outline.api_url, prometheus.port)
+                for _ in range(50)]
+            self.assertEqual(check_servers(servers, concurrency=10), [])
+        self.assertEqual(len(outline.requests), 50)
+        self.assertFalse(
+            OutlineServer.objects.filter(api_latency__isnull=True).exists())
+
+
+@override_settings(SERVER_BREAKER_THRESHOLD=2)
+class BreakerTest(TestCase):
+    """
+    Tests for the per-server circuit breakers
+    """
+
+    def setUp(self):
+        cache.clear()
+        self.server = baker.make(
+            OutlineServer, active=True, is_distributing=True, level=0, user_src='TG')
+
+    def test_opens_after_threshold(self):
+        self.assertEqual(record_failure(self.server.id), 1)
+        self.assertEqual(open_breakers([self.server.id]), set())
+        self.assertEqual(candidate_servers(0, 'TG'), [self.server])
+
+        self.assertEqual(record_failure(self.server.id), 2)
+        self.assertEqual(open_breakers([self.server.id]), {self.server.id})
+        self.assertEqual(candidate_servers(0, 'TG'), [])
+
+    def test_success_closes(self):
+        record_failure(self.server.id)
+        record_failure(self.server.id)
+        record_success(self.server.id)
+        self.assertEqual(open_breakers([self.server.id]), set())
+        self.assertEqual(record_failure(self.server.id), 1)
+
+
+@mock.patch('server.allocation.transaction.on_commit', lambda func: func())
+class CapacityTest(TestCase):
+    """
+    Tests for capacity-aware allocation
+    """
+
+    def setUp(self):
+        cache.clear()
+        self.busy, self.idle = baker.make(
+            OutlineServer,
+            active=True,
+            is_distributing=True,
+            level=0,
+            user_src='TG',
+            capacity=100,
+            _quantity=2)
+
+    def test_least_loaded_is_preferred(self):
+        update_user_counts({self.busy.id: 95})
+        cache.clear()
+        first = [candidate_servers(0, 'TG')[0] for _ in range(200)]
+        self.assertGreater(first.count(self.idle), 180)
+
+    def test_cached_counts_are_refreshed(self):
+        candidate_servers(0, 'TG')
+        update_user_counts({self.busy.id: 95})
+        with self.assertNumQueries(0):
+            first = [candidate_servers(0, 'TG')[0] for _ in range(200)]
+        self.assertGreater(first.count(self.idle), 180)
+
+    def test_full_server_stops_distributing(self):
+        self.assertEqual(len(eligible_servers(0, 'TG')), 2)
+        update_user_counts({self.busy.id: 99, self.idle.id: 1})
+        update_user_counts({self.busy.id: 1, self.idle.id: -1})
+
+        self.busy.refresh_from_db()
+        self.idle.refresh_from_db()
+        self.assertEqual((self.busy.user_count, self.idle.user_count), (100, 0))
+        self.assertFalse(self.busy.is_distributing)
+        self.assertTrue(self.idle.is_distributing)
+        self.assertEqual(eligible_servers(0, 'TG'), [self.idle])
+
+
+class AdminTest(TestCase):
+    """
+    Tests for editing servers in the admin
+    """
+
+    def test_save_keeps_maintained_fields(self):
+        server = baker.make(OutlineServer, name='a', ipv4='127.0.0.1')
+        model_admin = OutlineServerAdmin(OutlineServer, AdminSite())
+        self.assertIn(
+            'user_count', model_admin.get_readonly_fields(mock.Mock(), server))
+
+        OutlineServer.objects.filter(id=server.id).update(
+            user_count=5, is_distributing=False, is_healthy=False)
+        server.name = 'b'
+        model_admin.save_model(
+            mock.Mock(), server, mock.Mock(changed_data=['name', 'region']), True)
+
+        server.refresh_from_db()
+        self.assertEqual(server.name, 'b')
+        self.assertEqual(server.user_count, 5)
+        self.assertFalse(server.is_distributing)
+        self.assertFalse(server.is_healthy)
@@ -0,0 +1,41 @@
+# Copyright 2020 ASL19 Organization
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import time
+from contextlib import contextmanager
+
+from django.dispatch import Signal
+
+# Sent with the service, operation and duration of every upstream call
+upstream_called = Signal()
+
+
+@contextmanager
+def observe_upstream(service, operation):
+    """
+    Time a call to an Outline or Prometheus API and send
+    upstream_called with its duration in seconds
+    """
+    if not upstream_called.receivers:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        upstream_called.send(
+            sender=None,
+            service=service,
+            operation=operation,
+            duration=time.perf_counter() - start)